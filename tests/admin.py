@@ -0,0 +1,13 @@
+from django.contrib import admin
+
+from tests.models import Category
+from treenode.admin import TreeNodeModelAdmin
+from treenode.forms import TreeNodeForm
+
+
+class CategoryAdmin(TreeNodeModelAdmin):
+    treenode_display_mode = TreeNodeModelAdmin.TREENODE_DISPLAY_MODE_ACCORDION
+    form = TreeNodeForm
+
+
+admin.site.register(Category, CategoryAdmin)
@@ -0,0 +1,336 @@
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import timeit
+import tracemalloc
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import connections, router
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import treenode
+from treenode.cache import clear_cache, update_cache
+from treenode.indexes import get_tree_indexes
+from treenode.signals import no_signals
+
+logger = logging.getLogger(__name__)
+
+
+# Tree shapes
+# Each generator returns the list of parent indexes (None for roots),
+# the parent index of each node is always lower than the node index.
+
+
+def get_flat_tree_parents(size, rnd):
+    return [None] * size
+
+
+def get_wide_tree_parents(size, rnd):
+    roots_count = min(size, 10)
+    return [None if i < roots_count else i % roots_count for i in range(size)]
+
+
+def get_deep_tree_parents(size, rnd):
+    return [None if i == 0 else i - 1 for i in range(size)]
+
+
+def get_balanced_tree_parents(size, rnd, fan_out=4):
+    return [None if i == 0 else (i - 1) // fan_out for i in range(size)]
+
+
+def get_random_tree_parents(size, rnd):
+    return [None if i == 0 else rnd.randrange(-1, i) for i in range(size)]
+
+
+def get_skewed_tree_parents(size, rnd):
+    # few nodes have most of the children (power-law like fan-out)
+    return [None if i == 0 else int((rnd.random() ** 3) * i) for i in range(size)]
+
+
+TREE_SHAPES = {
+    "flat": get_flat_tree_parents,
+    "wide": get_wide_tree_parents,
+    "deep": get_deep_tree_parents,
+    "balanced": get_balanced_tree_parents,
+    "random": get_random_tree_parents,
+    "skewed": get_skewed_tree_parents,
+}
+
+
+def get_tree_parents(shape, size, seed=0):
+    rnd = random.Random(seed)
+    parents = TREE_SHAPES[shape](size, rnd)
+    return [None if parent == -1 else parent for parent in parents]
+
+
+def create_tree(model, shape, size, seed=0):
+    """
+    Creates a tree with the given shape and size using one bulk insert
+    for each tree level, the tree fields are not updated.
+    """
+    parents = get_tree_parents(shape, size, seed=seed)
+    levels = []
+    for parent in parents:
+        levels.append(0 if parent is None else levels[parent] + 1)
+    objs = [None] * size
+    with no_signals():
+        for level in range(max(levels, default=-1) + 1):
+            level_indexes = [i for i in range(size) if levels[i] == level]
+            level_objs = [
+                model(
+                    name=f"{shape}-{i}",
+                    tn_parent=objs[parents[i]] if parents[i] is not None else None,
+                )
+                for i in level_indexes
+            ]
+            level_objs = model.objects.bulk_create(level_objs)
+            for i, obj in zip(level_indexes, level_objs, strict=True):
+                objs[i] = obj
+    return objs
+
+
+# Measurement
+
+
+def get_environment_info(model):
+    connection = connections[router.db_for_write(model)]
+    return {
+        "treenode": treenode.__version__,
+        "django": django.__version__,
+        "python": platform.python_version(),
+        "database": connection.vendor,
+    }
+
+
+def measure(func, using="default"):
+    """
+    Runs func twice and returns its duration (seconds) measured in the first run,
+    queries count and peak of memory allocated (bytes) measured in the second run,
+    so that tracing memory allocations doesn't slow down the timed run.
+    """
+    timer = timeit.default_timer()
+    func()
+    duration = timeit.default_timer() - timer
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connections[using]) as queries:
+            func()
+        _, memory_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "duration": duration,
+        "queries": len(queries),
+        "memory_peak": memory_peak,
+    }
+
+
+# Operations
+
+
+def get_admin_changelist_client(model):
+    user_model = get_user_model()
+    username = "treenode-benchmark"
+    user = user_model.objects.filter(username=username).first()
+    if not user:
+        user = user_model.objects.create_superuser(
+            username=username, email="", password="treenode-benchmark"
+        )
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def get_init_operations(model, objs):
+    """
+    Returns the (name, func) operations instantiating the nodes (without queries),
+    compared to a non-tree model they measure the treenode signals overhead.
+    """
+    user_model = get_user_model()
+
+    def init():
+        for obj in objs:
+            model(pk=obj.pk, name=obj.name, tn_parent_id=obj.tn_parent_id)
+
+    def init_non_tree():
+        for obj in objs:
+            user_model(pk=obj.pk, username=obj.name)
+
+    return [
+        ("init", init),
+        ("init_non_tree", init_non_tree),
+    ]
+
+
+def get_operations(model, objs, seed=0):
+    """
+    Returns the list of (name, func) operations to benchmark on an existing tree.
+    """
+    rnd = random.Random(seed)
+    roots = [obj for obj in objs if obj.tn_parent_id is None]
+    client = get_admin_changelist_client(model)
+    changelist_url = reverse(
+        f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"
+    )
+
+    def rebuild():
+        model.update_tree()
+
+    def cache_warm_up():
+        clear_cache(model)
+        update_cache(model)
+
+    def get_tree():
+        model.get_tree()
+
+    def get_descendants():
+        roots[0].get_descendants()
+
+    def relationship_checks():
+        nodes = model._get_all()
+        root = nodes[0]
+        for obj in nodes:
+            obj.is_descendant_of(root)
+            obj.is_child_of(root)
+            root.is_ancestor_of(obj)
+            root.is_parent_of(obj)
+
+    # operations are measured twice, each run inserts, moves and deletes one node
+    inserts_count = itertools.count()
+
+    def insert():
+        parent = rnd.choice(objs)
+        name = f"benchmark-insert-{next(inserts_count)}"
+        model.objects.create(name=name, tn_parent=parent)
+
+    def move():
+        obj = model.objects.filter(name__startswith="benchmark-insert").first()
+        obj.set_parent(roots[-1])
+
+    def delete():
+        model.objects.filter(name__startswith="benchmark-insert").first().delete()
+
+    def admin_changelist():
+        response = client.get(changelist_url)
+        assert response.status_code == 200
+
+    return [
+        ("rebuild", rebuild),
+        ("cache_warm_up", cache_warm_up),
+        *get_init_operations(model, objs),
+        ("get_tree", get_tree),
+        ("get_descendants", get_descendants),
+        ("relationship_checks", relationship_checks),
+        ("insert", insert),
+        ("move", move),
+        ("delete", delete),
+        ("admin_changelist", admin_changelist),
+    ]
+
+
+# Indexes
+
+
+def get_indexes_queries(model, objs):
+    """
+    Returns the list of (name, queryset) queries served by the recommended
+    tree indexes (treenode.indexes.get_tree_indexes).
+    """
+    root = next(obj for obj in objs if obj.tn_parent_id is None)
+    return [
+        ("roots", model.get_roots_queryset()),
+        ("level", model.objects.filter(tn_level=2)),
+        ("children", model.objects.filter(tn_parent=root).order_by("tn_order")),
+        ("ordering", model.objects.order_by("tn_order")[:100]),
+    ]
+
+
+def set_tree_indexes(model, enabled):
+    using = router.db_for_write(model)
+    with connections[using].schema_editor() as schema_editor:
+        for index in get_tree_indexes():
+            index.set_name_with_model(model)
+            if enabled:
+                schema_editor.add_index(model, index)
+            else:
+                schema_editor.remove_index(model, index)
+
+
+def get_indexes_results(model, objs):
+    """
+    Runs the indexes queries without and with the recommended tree indexes
+    (created temporarily) and returns their query plans and measurements.
+    """
+    using = router.db_for_write(model)
+    results = []
+    for indexed in [False, True]:
+        if indexed:
+            set_tree_indexes(model, True)
+        try:
+            for name, queryset in get_indexes_queries(model, objs):
+                result = {"query": name, "indexed": indexed}
+                result["plan"] = queryset.explain()
+                result.update(measure(lambda qs=queryset: list(qs.all()), using=using))
+                results.append(result)
+        finally:
+            if indexed:
+                set_tree_indexes(model, False)
+    return results
+
+
+def run_benchmark(model, shapes=None, sizes=None, seed=0):
+    """
+    Runs all operations and indexes queries for each tree shape and size
+    and returns the results as a json serializable dict,
+    the model tree is deleted before each run.
+    """
+    shapes = shapes or list(TREE_SHAPES.keys())
+    sizes = sizes or [100]
+    using = router.db_for_write(model)
+    results = []
+    indexes_results = []
+    for shape in shapes:
+        for size in sizes:
+            model.delete_tree()
+            objs = create_tree(model, shape, size, seed=seed)
+            for name, func in get_operations(model, objs, seed=seed):
+                result = {"shape": shape, "size": size, "operation": name}
+                result.update(measure(func, using=using))
+                results.append(result)
+            for result in get_indexes_results(model, objs):
+                indexes_results.append({"shape": shape, "size": size, **result})
+            model.delete_tree()
+    return {
+        "environment": get_environment_info(model),
+        "results": results,
+        "indexes": indexes_results,
+    }
+
+
+def get_benchmark_settings():
+    """
+    Reads the benchmark settings from the environment:
+    TREENODE_BENCHMARK_SHAPES (eg. "flat,deep"), TREENODE_BENCHMARK_SIZES
+    (eg. "1000,10000") and TREENODE_BENCHMARK_OUTPUT (json output file path).
+    """
+    shapes = os.environ.get("TREENODE_BENCHMARK_SHAPES", "")
+    shapes = [shape for shape in shapes.split(",") if shape] or None
+    sizes = os.environ.get("TREENODE_BENCHMARK_SIZES", "")
+    sizes = [int(size) for size in sizes.split(",") if size] or None
+    output = os.environ.get("TREENODE_BENCHMARK_OUTPUT") or None
+    return (shapes, sizes, output)
+
+
+def write_benchmark(data, output=None):
+    data_json = json.dumps(data, indent=4)
+    if output:
+        with open(output, "w") as file:
+            file.write(data_json)
+    logger.debug(data_json)
+    return data_json
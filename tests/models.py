@@ -6,6 +6,7 @@ from abc import ABCMeta, abstractmethod
 from django.db import models
 from django.db.models.base import ModelBase
 
+from treenode.indexes import get_tree_indexes
 from treenode.models import TreeNodeModel
 
 
@@ -61,6 +62,52 @@ class CategoryWithUUIDPk(TreeNodeModel):
         verbose_name_plural = "Categories"
 
 
+class CategoryWithCompactPks(TreeNodeModel):
+    treenode_display_field = "name"
+    treenode_pks_encoding = "compact"
+
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta(TreeNodeModel.Meta):
+        app_label = "tests"
+        verbose_name = "Category"
+        verbose_name_plural = "Categories"
+
+
+class CategoryWithScope(TreeNodeModel):
+    treenode_display_field = "name"
+    treenode_scope_field = "tenant"
+
+    name = models.CharField(max_length=50)
+    tenant = models.CharField(max_length=50)
+
+    class Meta(TreeNodeModel.Meta):
+        app_label = "tests"
+        indexes = get_tree_indexes(scope_field="tenant")
+        verbose_name = "Category"
+        verbose_name_plural = "Categories"
+
+
+class Tenant(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        app_label = "tests"
+
+
+class CategoryWithTenant(TreeNodeModel):
+    treenode_display_field = "name"
+    treenode_scope_field = "tenant"
+
+    name = models.CharField(max_length=50)
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
+
+    class Meta(TreeNodeModel.Meta):
+        app_label = "tests"
+        verbose_name = "Category"
+        verbose_name_plural = "Categories"
+
+
 class CategoryWithoutDisplayField(TreeNodeModel):
     name = models.CharField(max_length=50, unique=True)
 
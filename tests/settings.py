@@ -38,8 +38,14 @@ if github_workflow:
     database_config["postgres"]["HOST"] = "127.0.0.1"
     database_config["postgres"]["PORT"] = "5432"
 
+# the "other" database is used to test trees in multiple databases
+database_other_config = dict(database_config.get(database_engine))
+if database_engine != "sqlite":
+    database_other_config["NAME"] = f"{database_other_config['NAME']}_other"
+
 DATABASES = {
     "default": database_config.get(database_engine),
+    "other": database_other_config,
 }
 
 INSTALLED_APPS = [
@@ -55,11 +61,13 @@ INSTALLED_APPS = [
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
 MIDDLEWARE = [
+    "django.contrib.sessions.middleware.SessionMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
 ]
 
+ROOT_URLCONF = "tests.urls"
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -0,0 +1,102 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.test import TransactionTestCase
+
+from tests.models import Category
+
+
+class TreeNodeAsyncTestCase(TransactionTestCase):
+    def setUp(self):
+        """
+        a
+            aa
+                aaa
+            ab
+        b
+        """
+        self.a = Category.objects.create(name="a")
+        self.aa = Category.objects.create(name="aa", tn_parent=self.a)
+        self.aaa = Category.objects.create(name="aaa", tn_parent=self.aa)
+        self.ab = Category.objects.create(name="ab", tn_parent=self.a)
+        self.b = Category.objects.create(name="b")
+        for obj in [self.a, self.aa, self.aaa, self.ab, self.b]:
+            obj.refresh_from_db()
+
+    def tearDown(self):
+        Category.delete_tree()
+
+    def __get_names(self, objs):
+        return [obj.name for obj in objs]
+
+    async def test_aget_nodes(self):
+        for cache in [True, False]:
+            with self.subTest(cache=cache):
+                self.assertEqual(
+                    self.__get_names(await self.aaa.aget_ancestors(cache=cache)),
+                    ["a", "aa"],
+                )
+                self.assertEqual(
+                    self.__get_names(await self.aaa.aget_breadcrumbs(cache=cache)),
+                    ["a", "aa", "aaa"],
+                )
+                self.assertEqual(
+                    self.__get_names(await self.a.aget_children(cache=cache)),
+                    ["aa", "ab"],
+                )
+                self.assertEqual(
+                    self.__get_names(await self.a.aget_descendants(cache=cache)),
+                    ["aa", "aaa", "ab"],
+                )
+                self.assertEqual(
+                    self.__get_names(await self.aa.aget_siblings(cache=cache)),
+                    ["ab"],
+                )
+                self.assertEqual(
+                    self.__get_names(await Category.aget_roots(cache=cache)),
+                    ["a", "b"],
+                )
+                self.assertEqual(
+                    (await self.a.aget_first_child(cache=cache)).name, "aa"
+                )
+                self.assertEqual((await self.a.aget_last_child(cache=cache)).name, "ab")
+                self.assertEqual(await self.b.aget_first_child(cache=cache), None)
+                self.assertEqual((await self.aaa.aget_parent(cache=cache)).name, "aa")
+                self.assertEqual(await self.a.aget_parent(cache=cache), None)
+                self.assertEqual((await self.aaa.aget_root(cache=cache)).name, "a")
+
+    async def test_aget_tree(self):
+        tree = await Category.aget_tree()
+        self.assertEqual([item["node"].name for item in tree], ["a", "b"])
+        self.assertEqual([item["node"].name for item in tree[0]["tree"]], ["aa", "ab"])
+        descendants_tree = await self.a.aget_descendants_tree(cache=False)
+        self.assertEqual([item["node"].name for item in descendants_tree], ["aa", "ab"])
+
+    async def test_aget_tree_json(self):
+        for cache in [True, False]:
+            with self.subTest(cache=cache):
+                tree_json = await Category.aget_tree_json(cache=cache)
+                self.assertEqual(
+                    tree_json, await sync_to_async(Category.get_tree_json)()
+                )
+                tree_data = json.loads(tree_json)
+                self.assertEqual(
+                    [item["node"]["display"] for item in tree_data], ["a", "b"]
+                )
+                descendants_tree_json = await self.a.aget_descendants_tree_json(
+                    cache=cache
+                )
+                self.assertEqual(
+                    descendants_tree_json,
+                    await sync_to_async(self.a.get_descendants_tree_json)(),
+                )
+                descendants_tree_data = json.loads(descendants_tree_json)
+                self.assertEqual(
+                    [item["node"]["display"] for item in descendants_tree_data],
+                    ["aa", "ab"],
+                )
+
+    async def test_aupdate_tree(self):
+        stats = await Category.aupdate_tree(dry_run=True)
+        self.assertEqual(stats.nodes, 5)
+        self.assertEqual(stats.changes, {})
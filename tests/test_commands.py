@@ -0,0 +1,97 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TransactionTestCase
+
+from tests.models import Category
+from treenode.signals import no_signals
+
+
+class TreeNodeRebuildCommandTestCase(TransactionTestCase):
+    def setUp(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="aa", tn_parent=a)
+        Category.objects.create(name="b")
+
+    def tearDown(self):
+        Category.delete_tree()
+
+    def _call_command(self, *args, **kwargs):
+        out = StringIO()
+        call_command("treenode_rebuild", *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_rebuild(self):
+        output = self._call_command("tests.Category")
+        self.assertIn("tests.Category: 0 rows and 0 fields changed", output)
+        with no_signals():
+            Category.objects.filter(name="aa").update(tn_level=1, tn_ancestors_pks="")
+        output = self._call_command("tests.Category", verbosity=2)
+        self.assertIn("tests.Category: 1 rows and 2 fields changed", output)
+        self.assertIn("tn_level: 1", output)
+        self.assertEqual(Category.objects.get(name="aa").tn_level, 2)
+
+    def test_rebuild_all_models(self):
+        output = self._call_command()
+        self.assertIn("tests.Category:", output)
+        self.assertIn("tests.CategoryFixtures:", output)
+        self.assertNotIn("tests.AbstractCategoryProxy:", output)
+
+    def test_rebuild_dry_run(self):
+        with no_signals():
+            Category.objects.filter(name="aa").update(tn_level=1)
+        output = self._call_command("tests.Category", dry_run=True)
+        self.assertIn("tests.Category: 1 rows and 1 fields would change", output)
+        self.assertEqual(Category.objects.get(name="aa").tn_level, 1)
+
+    def test_rebuild_invalid_model(self):
+        with self.assertRaises(CommandError):
+            self._call_command("tests.Invalid")
+        with self.assertRaises(CommandError):
+            self._call_command("auth.User")
+
+
+class TreeNodeCheckCommandTestCase(TransactionTestCase):
+    def setUp(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="aa", tn_parent=a)
+        Category.objects.create(name="b")
+
+    def tearDown(self):
+        Category.delete_tree()
+
+    def _call_command(self, *args, **kwargs):
+        out = StringIO()
+        call_command("treenode_check", *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_check(self):
+        output = self._call_command("tests.Category")
+        self.assertEqual(output, "tests.Category: OK\n")
+
+    def test_check_mismatching(self):
+        aa = Category.objects.get(name="aa")
+        with no_signals():
+            Category.objects.filter(pk=aa.pk).update(tn_order=0, tn_ancestors_pks="")
+        with self.assertRaises(CommandError):
+            self._call_command("tests.Category", chunk_size=1)
+        self.assertEqual(Category.objects.get(pk=aa.pk).tn_order, 0)
+        output = self._call_command("tests.Category", repair=True)
+        self.assertIn("tests.Category: 2 fields repaired", output)
+        self.assertIn(f"tn_ancestors_pks: 1 rows (pks: {aa.pk})", output)
+        self.assertIn(f"tn_order: 1 rows (pks: {aa.pk})", output)
+        self.assertEqual(Category.objects.get(pk=aa.pk).tn_order, 1)
+        output = self._call_command("tests.Category")
+        self.assertEqual(output, "tests.Category: OK\n")
+
+    def test_check_circular_refs(self):
+        a = Category.objects.get(name="a")
+        aa = Category.objects.get(name="aa")
+        with no_signals():
+            Category.objects.filter(pk=a.pk).update(tn_parent=aa)
+        with self.assertRaises(CommandError):
+            self._call_command("tests.Category")
+        with self.assertRaises(CommandError):
+            self._call_command("tests.Category", repair=True)
+        Category.objects.filter(pk=a.pk).update(tn_parent=None)
@@ -0,0 +1,52 @@
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase
+
+from tests.models import Category
+from treenode.decorators import get_tree_etag, get_tree_last_modified, tree_condition
+
+
+@tree_condition(Category)
+def category_tree_view(request):
+    return HttpResponse(Category.get_tree_display())
+
+
+class TreeNodeDecoratorsTestCase(TransactionTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        Category.objects.create(name="a")
+
+    def tearDown(self):
+        Category.delete_tree()
+
+    def test_get_tree_etag(self):
+        etag = get_tree_etag(Category)
+        self.assertEqual(etag, get_tree_etag(Category))
+        Category.objects.create(name="b")
+        self.assertNotEqual(etag, get_tree_etag(Category))
+
+    def test_get_tree_last_modified(self):
+        last_modified = get_tree_last_modified(Category)
+        self.assertIsNotNone(last_modified)
+        Category.objects.create(name="b")
+        self.assertGreaterEqual(get_tree_last_modified(Category), last_modified)
+
+    def test_tree_condition(self):
+        response = category_tree_view(self.factory.get("/"))
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        request = self.factory.get("/", headers={"if-none-match": etag})
+        response = category_tree_view(request)
+        self.assertEqual(response.status_code, 304)
+        Category.objects.create(name="b")
+        response = category_tree_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_tree_condition_after_delete_tree(self):
+        response = category_tree_view(self.factory.get("/"))
+        etag = response["ETag"]
+        Category.delete_tree()
+        request = self.factory.get("/", headers={"if-none-match": etag})
+        response = category_tree_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
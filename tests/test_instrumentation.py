@@ -0,0 +1,91 @@
+from django.test import TransactionTestCase, override_settings
+
+from tests.models import Category
+from treenode.cache import clear_cache
+from treenode.instrumentation import count_queries, treenode_event
+
+events_handler_calls = []
+
+
+def events_handler(name, model, data):
+    events_handler_calls.append((name, model, data))
+
+
+class TreeNodeInstrumentationTestCase(TransactionTestCase):
+    def setUp(self):
+        self.events = []
+        treenode_event.connect(self._receiver)
+        events_handler_calls.clear()
+
+    def tearDown(self):
+        treenode_event.disconnect(self._receiver)
+        Category.delete_tree()
+
+    def _receiver(self, sender, name, data, **kwargs):
+        self.events.append((name, sender, data))
+
+    def _get_events(self, name):
+        return [event for event in self.events if event[0] == name]
+
+    @override_settings(DEBUG=False)
+    def test_count_queries(self):
+        with count_queries() as queries:
+            list(Category.objects.all())
+            Category.objects.count()
+        self.assertEqual(queries.count, 2)
+
+    @override_settings(DEBUG=False)
+    def test_rebuild_events(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="aa", tn_parent=a)
+        self.events.clear()
+        Category.update_tree()
+        names = [event[0] for event in self.events]
+        self.assertEqual(names[0], "rebuild_started")
+        self.assertEqual(names[-1], "rebuild_finished")
+        _, sender, data = self._get_events("rebuild_finished")[0]
+        self.assertEqual(sender, Category)
+        self.assertEqual(data["nodes"], 2)
+        self.assertEqual(data["rows_changed"], 0)
+        self.assertGreater(data["queries"], 0)
+        self.assertGreaterEqual(data["duration"], 0)
+
+    def test_rebuild_failed_event(self):
+        a = Category.objects.create(name="a")
+        Category.objects.filter(pk=a.pk).update(tn_parent=a)
+        with self.assertRaises(ValueError):
+            Category.update_tree()
+        self.assertEqual(len(self._get_events("rebuild_failed")), 1)
+        Category.objects.filter(pk=a.pk).update(tn_parent=None)
+
+    def test_cache_events(self):
+        Category.objects.create(name="a")
+        clear_cache(Category)
+        self.events.clear()
+        Category.get_roots()
+        Category.get_roots()
+        self.assertTrue(self._get_events("cache_hit"))
+        cache_set_events = self._get_events("cache_set")
+        self.assertTrue(cache_set_events)
+        self.assertTrue(all(event[2]["bytes"] > 0 for event in cache_set_events))
+
+    @override_settings(
+        TREENODE_EVENTS_HANDLER="tests.test_instrumentation.events_handler"
+    )
+    def test_events_handler(self):
+        Category.objects.create(name="a")
+        names = [call[0] for call in events_handler_calls]
+        self.assertIn("rebuild_started", names)
+        self.assertIn("rebuild_finished", names)
+
+    def test_events_receiver_error(self):
+        def receiver(sender, name, data, **kwargs):
+            raise RuntimeError("receiver error")
+
+        treenode_event.connect(receiver)
+        try:
+            with self.assertLogs("treenode.instrumentation", level="ERROR"):
+                Category.objects.create(name="a")
+        finally:
+            treenode_event.disconnect(receiver)
+        self.assertEqual(Category.objects.get(name="a").tn_level, 1)
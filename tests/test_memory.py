@@ -0,0 +1,74 @@
+import gc
+
+from django.test import TransactionTestCase
+
+from tests.models import Category
+from treenode.memory import get_refs, get_refs_count, no_refs, update_refs
+
+
+class TreeNodeMemoryTestCase(TransactionTestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        Category.delete_tree()
+
+    def test_refs_indexed_by_pk(self):
+        a = Category.objects.create(name="a")
+        b = Category.objects.create(name="b", tn_parent=a)
+        a_copy = Category.objects.get(pk=a.pk)
+        refs = get_refs(Category)
+        self.assertTrue(any(obj is a for obj in refs))
+        self.assertTrue(any(obj is a_copy for obj in refs))
+        self.assertTrue(any(obj is b for obj in refs))
+        # instances with the same pk are tracked separately
+        update_refs(Category, {str(a.pk): {"tn_level": 9}})
+        self.assertEqual(a.tn_level, 9)
+        self.assertEqual(a_copy.tn_level, 9)
+        self.assertEqual(b.tn_level, 2)
+
+    def test_refs_count(self):
+        Category.delete_tree()
+        gc.collect()
+        self.assertEqual(get_refs_count(Category), 0)
+        a = Category.objects.create(name="a")
+        b = Category.objects.create(name="b", tn_parent=a)
+        count = get_refs_count(Category)
+        self.assertGreaterEqual(count, 2)
+        self.assertGreaterEqual(get_refs_count(), count)
+        del a, b
+        gc.collect()
+        self.assertEqual(get_refs_count(Category), 0)
+
+    def test_refs_updated_by_tree_update(self):
+        a = Category.objects.create(name="a")
+        b = Category.objects.create(name="b", tn_parent=a)
+        c = Category.objects.create(name="c")
+        b.set_parent(c)
+        self.assertEqual(c.tn_children_count, 1)
+        self.assertEqual(a.tn_children_count, 0)
+
+    def test_no_refs(self):
+        a = Category.objects.create(name="a")
+        with no_refs():
+            a_copy = Category.objects.get(pk=a.pk)
+            b = Category.objects.create(name="b", tn_parent=a)
+        refs = get_refs(Category)
+        self.assertTrue(any(obj is a for obj in refs))
+        self.assertFalse(any(obj is a_copy for obj in refs))
+        self.assertFalse(any(obj is b for obj in refs))
+        c = Category.objects.create(name="c", tn_parent=a)
+        self.assertEqual(a.tn_children_count, 2)
+        self.assertEqual(a_copy.tn_children_count, 0)
+        self.assertTrue(any(obj is c for obj in get_refs(Category)))
+
+    def test_track_instances_option(self):
+        Category.treenode_track_instances = False
+        try:
+            a = Category.objects.create(name="a")
+            a_copy = Category.objects.get(pk=a.pk)
+            refs = get_refs(Category)
+            self.assertFalse(any(obj is a for obj in refs))
+            self.assertFalse(any(obj is a_copy for obj in refs))
+        finally:
+            Category.treenode_track_instances = True
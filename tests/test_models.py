@@ -1,6 +1,15 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
 from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models.signals import post_init
 from django.test import override_settings
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import force_str
 
 from tests.models import (
@@ -10,7 +19,10 @@ from tests.models import (
     CategoryWithUUIDPk,
 )
 from treenode.cache import clear_cache
-from treenode.utils import join_pks
+from treenode.exceptions import CircularReferenceError
+from treenode.models import TreeNodeVersion
+from treenode.signals import no_signals
+from treenode.utils import join_pks, parse_pks
 
 
 # flake8: noqa
@@ -21,7 +33,8 @@ class TreeNodeModelTestCaseBase:
         pass
 
     def tearDown(self):
-        pass
+        # tree versions restart after each test flush, drop the cached ones
+        caches["treenode"].clear()
 
     def __create_cat(cls, name, parent=None, priority=0):
         return cls._category_model.objects.create(
@@ -207,11 +220,139 @@ class TreeNodeModelTestCaseBase:
                     obj.get_tree_display(cache=False),
                 )
 
+    def test_check_tree(self):
+        self.__create_cat_tree()
+        self.assertEqual(self._category_model.check_tree(), {})
+        aa = self.__get_cat(name="aa")
+        with no_signals():
+            self._category_model.objects.filter(name__startswith="a").update(tn_level=1)
+        report = self._category_model.check_tree(chunk_size=5, samples=2)
+        self.assertEqual(list(report.keys()), ["tn_level"])
+        self.assertEqual(report["tn_level"]["count"], 13)
+        self.assertEqual(len(report["tn_level"]["pks"]), 2)
+        self.assertEqual(self.__get_cat(name="aa").tn_level, 1)
+        report = self._category_model.check_tree(repair=True)
+        self.assertEqual(report["tn_level"]["count"], 13)
+        self.assertEqual(self.__get_cat(name="aa").tn_level, 2)
+        self.assertEqual(aa.tn_level, 2)
+        self.assertEqual(self._category_model.check_tree(), {})
+
+    def test_check_tree_circular_refs(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        a = self.__get_cat(name="a")
+        aa = self.__get_cat(name="aa")
+        aaa = self.__get_cat(name="aaa")
+        b = self.__get_cat(name="b")
+        with no_signals():
+            model.objects.filter(pk=a.pk).update(tn_parent=aaa)
+            model.objects.filter(pk=b.pk).update(tn_parent=b)
+        with self.assertRaises(CircularReferenceError):
+            model.update_tree()
+        # circular references are reported instead of raising an error
+        report = model.check_tree(repair=True)
+        self.assertEqual(report["circular_refs"]["count"], 4)
+        self.assertEqual(
+            sorted(report["circular_refs"]["pks"]),
+            sorted(str(obj.pk) for obj in [a, aa, aaa, b]),
+        )
+        model.objects.filter(pk__in=[a.pk, b.pk]).update(tn_parent=None)
+        model.update_tree()
+        self.assertEqual(model.check_tree(), {})
+
+    def test_check_tree_rows(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        instances = []
+
+        def on_post_init(sender, instance, **kwargs):
+            instances.append(instance)
+
+        post_init.connect(on_post_init, sender=model)
+        try:
+            self.assertEqual(model.check_tree(chunk_size=5), {})
+        finally:
+            post_init.disconnect(on_post_init, sender=model)
+        # the nodes are read as rows, not as model instances
+        self.assertEqual(instances, [])
+
     def test_debug_performance(self):
         settings.DEBUG = True
         self.__create_cat_tree()
         settings.DEBUG = False
 
+    def test_bulk_create_tree(self):
+        model = self._category_model
+        data = [
+            {
+                "name": "a",
+                "children": [
+                    {"name": "aa", "children": [{"name": "aaa"}]},
+                    (model(name="ab"), [model(name="aba")]),
+                ],
+            },
+            model(name="b"),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            objs = model.bulk_create_tree(data)
+        # one insert for each level
+        insert_sql = f'INSERT INTO "{model._meta.db_table}"'
+        inserts = [q for q in queries if q["sql"].startswith(insert_sql)]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(
+            [obj.name for obj in objs], ["a", "aa", "aaa", "ab", "aba", "b"]
+        )
+        a, aa, aaa, ab, aba, b = objs
+        # created instances are updated
+        self.assertEqual(a.tn_children_count, 2)
+        self.assertEqual(aaa.tn_ancestors_pks, join_pks([a.pk, aa.pk]))
+        self.assertEqual(b.tn_siblings_count, 1)
+        self.assertEqual(
+            [obj.name for obj in a.get_descendants()], ["aa", "aaa", "ab", "aba"]
+        )
+        self.assertEqual(model.check_tree(), {})
+        objs = model.bulk_create_tree([{"name": "bc"}, {"name": "bd"}], parent=b)
+        b.refresh_from_db()
+        self.assertEqual(b.get_children_pks(), tuple(obj.pk for obj in objs))
+        self.assertEqual(objs[0].tn_ancestors_count, 1)
+        with self.assertRaises(ValueError):
+            model.bulk_create_tree([{"name": "c"}], parent=model(name="d"))
+        with self.assertRaises(ValueError):
+            model.bulk_create_tree(["e"])
+
+    def test_copy_subtree(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        a = self.__get_cat(name="a")
+        b = self.__get_cat(name="b")
+        count = model.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            a_copy = a.copy_subtree(
+                parent=b,
+                field_overrides={"name": lambda obj: f"{obj.name}-copy"},
+            )
+        # one insert for each level
+        insert_sql = f'INSERT INTO "{model._meta.db_table}"'
+        inserts = [q for q in queries if q["sql"].startswith(insert_sql)]
+        self.assertEqual(len(inserts), 4)
+        self.assertEqual(model.objects.count(), count + 14)
+        self.assertEqual(a_copy.name, "a-copy")
+        self.assertEqual(a_copy.tn_parent, b)
+        self.assertEqual(
+            [obj.name.removesuffix("-copy") for obj in a_copy.get_descendants()],
+            [obj.name for obj in a.get_descendants()],
+        )
+        acaa_copy = self.__get_cat(name="acaa-copy")
+        self.assertEqual(
+            [obj.name for obj in acaa_copy.get_breadcrumbs()],
+            ["b", "a-copy", "ac-copy", "aca-copy", "acaa-copy"],
+        )
+        self.assertEqual(model.check_tree(), {})
+        # the original subtree is unchanged
+        a.refresh_from_db()
+        self.assertEqual(a.tn_parent, None)
+        self.assertEqual(a.get_descendants_count(), 13)
+
     def test_delete(self):
         self.__create_cat_tree()
         a = self.__get_cat(name="a")
@@ -298,6 +439,60 @@ class TreeNodeModelTestCaseBase:
         self.assertEqual(a.tn_children_count, 6)
         self.assertEqual(a.get_children_count(), 6)
 
+    def test_get_common_ancestor(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        a = self.__get_cat(name="a")
+        aa = self.__get_cat(name="aa")
+        aaaa = self.__get_cat(name="aaaa")
+        ab = self.__get_cat(name="ab")
+        acaa = self.__get_cat(name="acaa")
+        acab = self.__get_cat(name="acab")
+        aca = self.__get_cat(name="aca")
+        acb = self.__get_cat(name="acb")
+        b = self.__get_cat(name="b")
+        self.assertEqual(model.get_common_ancestor(acaa, acab), aca)
+        self.assertEqual(model.get_common_ancestor(acaa, acb).name, "ac")
+        self.assertEqual(model.get_common_ancestor(aaaa, acab), a)
+        self.assertEqual(model.get_common_ancestor(aaaa, aa), aa)
+        self.assertEqual(model.get_common_ancestor(aaaa, ab, acaa), a)
+        self.assertEqual(model.get_common_ancestor(aaaa), aaaa)
+        self.assertEqual(model.get_common_ancestor(acaa, acab, cache=False), aca)
+        self.assertEqual(model.get_common_ancestor(aaaa, b), None)
+        with self.assertRaises(ValueError):
+            model.get_common_ancestor()
+        with self.assertNumQueries(0):
+            model.get_common_ancestor(acaa, acab)
+
+    def test_get_distance(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        aa = self.__get_cat(name="aa")
+        aaaa = self.__get_cat(name="aaaa")
+        acab = self.__get_cat(name="acab")
+        b = self.__get_cat(name="b")
+        self.assertEqual(model.get_distance(aaaa, aaaa), 0)
+        self.assertEqual(model.get_distance(aaaa, aa), 2)
+        self.assertEqual(model.get_distance(aa, aaaa), 2)
+        self.assertEqual(model.get_distance(aaaa, acab), 6)
+        self.assertEqual(model.get_distance(aaaa, b), None)
+
+    def test_get_path(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        aaa = self.__get_cat(name="aaa")
+        acab = self.__get_cat(name="acab")
+        b = self.__get_cat(name="b")
+        names = ["aaa", "aa", "a", "ac", "aca", "acab"]
+        path = model.get_path(aaa, acab)
+        self.assertEqual([obj.name for obj in path], names)
+        path = model.get_path(acab, aaa, cache=False)
+        self.assertEqual([obj.name for obj in path], names[::-1])
+        self.assertEqual(model.get_path(aaa, aaa), [aaa])
+        self.assertEqual(model.get_path(aaa, b), None)
+        with self.assertNumQueries(0):
+            model.get_path(aaa, acab)
+
     def test_get_depth(self):
         self.__create_cat_tree()
         a = self.__get_cat(name="a")
@@ -900,6 +1095,68 @@ f
 """.strip()
         self.assertEqual(self._category_model.get_tree_display(), expected_tree_display)
 
+    def test_get_tree_json(self):
+        self.__create_cat_tree()
+        a = self.__get_cat(name="a")
+        aa = self.__get_cat(name="aa")
+        tree_json = self._category_model.get_tree_json()
+        self.assertTrue(isinstance(tree_json, bytes))
+        self.assertEqual(tree_json, self._category_model.get_tree_json(cache=False))
+        tree_data = json.loads(tree_json)
+        self.assertEqual(len(tree_data), 6)
+        self.assertEqual(tree_data[0]["node"]["display"], "a")
+        self.assertEqual(tree_data[0]["tree"][0]["node"]["display"], "aa")
+        self.assertEqual(str(tree_data[0]["tree"][0]["node"]["pk"]), str(aa.pk))
+        with self.assertNumQueries(0):
+            self._category_model.get_tree_json()
+        descendants_tree_json = a.get_descendants_tree_json()
+        self.assertEqual(
+            descendants_tree_json, a.get_descendants_tree_json(cache=False)
+        )
+        self.assertEqual(json.loads(descendants_tree_json), tree_data[0]["tree"])
+        # the serialized tree is regenerated when the tree is updated
+        aa.name = "ag"
+        aa.save()
+        tree_data = json.loads(self._category_model.get_tree_json())
+        self.assertEqual(tree_data[0]["tree"][-1]["node"]["display"], "ag")
+        descendants_tree_data = json.loads(a.get_descendants_tree_json())
+        self.assertEqual(descendants_tree_data[-1]["node"]["display"], "ag")
+
+    def test_get_tree_version(self):
+        version = self._category_model.get_tree_version()
+        self.__create_cat(name="a")
+        self.assertEqual(self._category_model.get_tree_version(), version + 1)
+        self.assertIsNotNone(self._category_model.get_tree_last_modified())
+        self._category_model.update_tree()
+        self.assertEqual(self._category_model.get_tree_version(), version + 2)
+        with self.assertNumQueries(0):
+            self._category_model.get_tree_version()
+
+    def test_delete_tree_version(self):
+        model = self._category_model
+        self.__create_cat(name="a")
+        version = model.get_tree_version()
+        last_modified = model.get_tree_last_modified()
+        model.delete_tree()
+        # the etag and last modified of the deleted tree change
+        self.assertEqual(model.get_tree_version(), version + 1)
+        self.assertGreaterEqual(model.get_tree_last_modified(), last_modified)
+        self.assertEqual(
+            model.get_tree_version(), TreeNodeVersion.get_version(model)[0]
+        )
+        self.assertEqual(TreeNodeVersion.get_checksum(model), model.get_tree_checksum())
+
+    def test_delete_tree_json(self):
+        model = self._category_model
+        self.__create_cat_tree()
+        a = self.__get_cat(name="a")
+        self.assertNotEqual(json.loads(model.get_tree_json()), [])
+        self.assertNotEqual(json.loads(a.get_descendants_tree_json()), [])
+        model.delete_tree()
+        # the cached json of the deleted tree is not served anymore
+        self.assertEqual(model.get_tree(), [])
+        self.assertEqual(json.loads(model.get_tree_json()), model.get_tree())
+
     def test_is_ancestor_of(self):
         self.__create_cat_tree()
         a = self.__get_cat(name="a")
@@ -1048,6 +1305,10 @@ f
         self.assertFalse(a.is_parent_of(c))
         self.assertTrue(aa.is_parent_of(aaa))
         self.assertTrue(aaa.is_parent_of(aaaa))
+        # the live parent is used, as in is_child_of
+        b.tn_parent = a
+        self.assertTrue(a.is_parent_of(b))
+        self.assertTrue(b.is_child_of(a))
 
     def test_is_root(self):
         self.__create_cat_tree()
@@ -1245,6 +1506,43 @@ f
         with self.assertNumQueries(0):
             a.is_sibling_of(b)
 
+    def test_move_nodes(self):
+        self.__create_cat_tree()
+        model = self._category_model
+        a = self.__get_cat(name="a")
+        aa = self.__get_cat(name="aa")
+        aaa = self.__get_cat(name="aaa")
+        ab = self.__get_cat(name="ab")
+        ba = self.__get_cat(name="ba")
+        bb = self.__get_cat(name="bb")
+        b = self.__get_cat(name="b")
+        with CaptureQueriesContext(connection) as queries:
+            model.move_nodes([aa, ab, ba], parent=bb)
+        # one update query for the parents and one for each changed row
+        parents_updates = [q for q in queries if 'SET "tn_parent_id"' in q["sql"]]
+        self.assertEqual(len(parents_updates), 1)
+        a.refresh_from_db()
+        bb.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual([obj.name for obj in bb.get_children()], ["aa", "ab", "ba"])
+        self.assertEqual(aaa.get_ancestors_pks(), (b.pk, bb.pk, aa.pk))
+        self.assertEqual(b.get_descendants_count(), 7)
+        self.assertEqual(a.get_children_count(), 4)
+        self.assertEqual(model.check_tree(), {})
+        model.move_nodes([ab], parent=bb, priority=10)
+        self.assertEqual(bb.get_first_child().name, "ab")
+        model.move_nodes([aa, ab])
+        self.assertTrue(aa.is_root())
+        self.assertTrue(ab.is_root())
+        # cycles
+        with self.assertRaises(ValueError):
+            model.move_nodes([b], parent=bb)
+        with self.assertRaises(ValueError):
+            model.move_nodes([b, a], parent=b)
+        with self.assertRaises(ValueError):
+            model.move_nodes([model(name="c")], parent=b)
+        model.move_nodes([])
+
     def test_properties(self):
         self.__create_cat_tree()
         a = self.__get_cat(name="a")
@@ -1284,6 +1582,23 @@ f
             self.assertEqual(obj.get_tree(), obj.tree)
             self.assertEqual(obj.get_tree_display(), obj.tree_display)
 
+    def test_pks(self):
+        self.__create_cat_tree()
+        a = self.__get_cat(name="a")
+        aa = self.__get_cat(name="aa")
+        aaa = self.__get_cat(name="aaa")
+        children_pks = a.get_children_pks()
+        self.assertIsInstance(children_pks, tuple)
+        self.assertEqual(list(children_pks), [obj.pk for obj in a.get_children()])
+        # pks are parsed once for each field value
+        self.assertIs(a.get_children_pks(), children_pks)
+        self.assertEqual(aaa.get_ancestors_pks(), (a.pk, aa.pk))
+        self.assertEqual(aaa.get_root_pk(), a.pk)
+        self.assertEqual(a.get_root_pk(), a.pk)
+        self.__create_cat(name="ag", parent=a)
+        ag = self.__get_cat(name="ag")
+        self.assertEqual(a.get_children_pks(), children_pks + (ag.pk,))
+
     def test_update_on_create(self):
         a = self.__create_cat(name="a")
         self.assertEqual(a.tn_children_pks, "")
@@ -1368,6 +1683,114 @@ f
         self.assertEqual(a.get_level(), 1)
         self.assertEqual(a.get_depth(), 0)
 
+    def test_update_tree_stats(self):
+        self.__create_cat_tree()
+        stats = self._category_model.update_tree()
+        self.assertEqual(stats.nodes, 22)
+        self.assertEqual(stats.changes, {})
+        self.assertEqual(stats.rows_changed, 0)
+        self.assertEqual(
+            list(stats.phases.keys()),
+            [
+                "check_circular_refs",
+                "load_nodes",
+                "compute_order",
+                "sort_nodes",
+                "compute_fields",
+                "compute_checksum",
+                "update_rows",
+                "update_refs",
+                "update_cache",
+            ],
+        )
+        self.assertGreaterEqual(stats.duration, sum(stats.phases.values()))
+        with no_signals():
+            self._category_model.objects.filter(name="aa").update(tn_level=1)
+        stats = self._category_model.update_tree(dry_run=True)
+        self.assertEqual(stats.rows_changed, 1)
+        self.assertEqual(stats.fields_changed, 1)
+        self.assertNotIn("update_rows", stats.phases)
+        self.assertEqual(stats.to_dict()["rows_changed"], 1)
+
+    def test_update_tree_profile(self):
+        self.__create_cat(name="a")
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(
+                TREENODE_PROFILE_THRESHOLD=0, TREENODE_PROFILE_DIR=profile_dir
+            ):
+                stats = self._category_model.update_tree()
+            self.assertTrue(stats.profile_path.startswith(profile_dir))
+            self.assertTrue(os.path.exists(stats.profile_path))
+            with override_settings(
+                TREENODE_PROFILE_THRESHOLD=60, TREENODE_PROFILE_DIR=profile_dir
+            ):
+                stats = self._category_model.update_tree()
+            self.assertIsNone(stats.profile_path)
+
+    def test_walk_descendants(self):
+        self.__create_cat_tree()
+        ac = self.__get_cat(name="ac")
+        events = [
+            (obj.name, depth, event)
+            for obj, depth, event in ac.walk_descendants(order="pre")
+        ]
+        self.assertEqual(
+            events,
+            [
+                ("aca", 0, "enter"),
+                ("acaa", 1, "enter"),
+                ("acaa", 1, "exit"),
+                ("acab", 1, "enter"),
+                ("acab", 1, "exit"),
+                ("aca", 0, "exit"),
+                ("acb", 0, "enter"),
+                ("acb", 0, "exit"),
+                ("acc", 0, "enter"),
+                ("acc", 0, "exit"),
+            ],
+        )
+        names = [obj.name for obj, _depth, _event in ac.walk_descendants("post")]
+        self.assertEqual(names, ["acaa", "acab", "aca", "acb", "acc"])
+        names = [obj.name for obj, _depth, _event in ac.walk_descendants("level")]
+        self.assertEqual(names, ["aca", "acb", "acc", "acaa", "acab"])
+        aaaa = self.__get_cat(name="aaaa")
+        self.assertEqual(list(aaaa.walk_descendants()), [])
+        with self.assertRaises(ValueError):
+            ac.walk_descendants(order="in")
+
+    def test_walk_tree(self):
+        self.__create_cat_tree()
+        objs = [
+            obj
+            for obj, _depth, event in self._category_model.walk_tree(order="pre")
+            if event == "enter"
+        ]
+        self.assertEqual(objs, list(self._category_model.objects.all()))
+        walk = list(self._category_model.walk_tree(order="level"))
+        self.assertEqual(
+            [obj.name for obj, depth, _event in walk if depth == 0],
+            ["a", "b", "c", "d", "e", "f"],
+        )
+        self.assertEqual(
+            [obj.name for obj, depth, _event in walk if depth == 3],
+            ["aaaa", "acaa", "acab"],
+        )
+        walk = list(self._category_model.walk_tree(order="post"))
+        self.assertEqual(len(walk), self._category_model.objects.count())
+        self.assertEqual(walk[0][0].name, "aaaa")
+        self.assertEqual(walk[-1][0].name, "f")
+
+    def test_walk_tree_parsed_children_pks(self):
+        self.__create_cat_tree()
+        with mock.patch("treenode.models.parse_pks", wraps=parse_pks) as parse_mock:
+            walk = list(self._category_model.walk_tree(cache=False))
+            parse_count = parse_mock.call_count
+            # the walk reuses the children pks parsed by get_children_pks
+            for obj, _depth, _event in walk:
+                obj.get_children_pks()
+            self.assertEqual(parse_mock.call_count, parse_count)
+        self.assertLessEqual(parse_count, self._category_model.objects.count())
+
     def test_deep_cat_tree_ordering(self):
         cat_level_list = []
         cat_level_parent = None
@@ -0,0 +1,83 @@
+from django.test import TransactionTestCase, override_settings
+
+from tests.models import Category
+from treenode.cache import clear_cache
+
+
+class ReplicaRouter:
+    """
+    Routes reads to the "other" database, used as read replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return "other"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class TreeNodeMultipleDatabasesTestCase(TransactionTestCase):
+    databases = {"default", "other"}
+
+    def tearDown(self):
+        Category.delete_tree()
+        Category.delete_tree(using="other")
+
+    def __get_names(self, objs):
+        return [obj.name for obj in objs]
+
+    def test_update_tree_using(self):
+        a = Category.objects.using("other").create(name="a")
+        Category.objects.using("other").create(name="aa", tn_parent=a)
+        Category.objects.create(name="b")
+        a = Category.objects.using("other").get(name="a")
+        self.assertEqual(a.tn_children_count, 1)
+        self.assertEqual(self.__get_names(a.get_children()), ["aa"])
+        self.assertEqual(self.__get_names(a.get_children(cache=False)), ["aa"])
+        self.assertEqual(self.__get_names(Category.get_roots(using="other")), ["a"])
+        self.assertEqual(self.__get_names(Category.get_roots()), ["b"])
+        self.assertEqual(len(Category.get_tree(using="other")), 1)
+        self.assertEqual(Category.get_tree(using="other")[0]["node"].name, "a")
+        self.assertGreater(Category.get_tree_version(using="other"), 0)
+        stats = Category.update_tree(dry_run=True, using="other")
+        self.assertEqual(stats.nodes, 2)
+
+    def test_delete_using(self):
+        a = Category.objects.using("other").create(name="a")
+        aa = Category.objects.using("other").create(name="aa", tn_parent=a)
+        aa.delete()
+        a.refresh_from_db()
+        self.assertEqual(a.tn_children_count, 0)
+        self.assertEqual(Category.objects.using("other").count(), 1)
+        Category.delete_tree(using="other")
+        self.assertEqual(Category.objects.using("other").count(), 0)
+
+    def test_copy_subtree_using(self):
+        a = Category.objects.using("other").create(name="a")
+        Category.objects.using("other").create(name="aa", tn_parent=a)
+        with override_settings(DATABASE_ROUTERS=[ReplicaRouter()]):
+            a = Category.objects.using("other").get(name="a")
+            # the copy is created in the database of the node, not the router one
+            a_copy = a.copy_subtree(
+                field_overrides={"name": lambda obj: f"{obj.name}2"}
+            )
+            self.assertEqual(a_copy._state.db, "other")
+            self.assertEqual(Category.objects.using("default").count(), 0)
+            self.assertEqual(Category.objects.using("other").count(), 4)
+            a_copy = Category.objects.using("other").get(pk=a_copy.pk)
+            self.assertEqual(a_copy.tn_descendants_count, 1)
+
+    def test_read_replica(self):
+        Category.objects.create(name="a")
+        with override_settings(DATABASE_ROUTERS=[ReplicaRouter()]):
+            # the cache warm-up reads from the (empty) replica
+            Category.delete_tree(using="other")
+            self.assertEqual(Category.objects.count(), 0)
+            clear_cache(Category)
+            self.assertEqual(Category.get_roots(), [])
+            Category.update_tree()
+            # the tree update reads from the primary database
+            self.assertEqual(self.__get_names(Category.get_roots()), ["a"])
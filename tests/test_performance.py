@@ -1,36 +1,97 @@
-from django.conf import settings
+import json
+
 from django.test import TransactionTestCase
 
+from tests.benchmark import (
+    TREE_SHAPES,
+    create_tree,
+    get_benchmark_settings,
+    get_tree_parents,
+    measure,
+    run_benchmark,
+    write_benchmark,
+)
 from tests.models import Category
-from treenode.debug import debug_performance
-from treenode.signals import no_signals
 
 
 class TreeNodePerformanceTestCase(TransactionTestCase):
+    """
+    Run the benchmark with custom shapes, sizes and json output file using:
+    TREENODE_BENCHMARK_SHAPES=flat,deep TREENODE_BENCHMARK_SIZES=1000,5000 \
+    TREENODE_BENCHMARK_OUTPUT=benchmark.json \
+    python -m django test tests.test_performance --settings "tests.settings"
+    """
+
     def setUp(self):
         pass
 
     def tearDown(self):
-        pass
+        Category.delete_tree()
 
-    def test_performance(self):
-        settings.DEBUG = True
-        message_prefix = (
-            f"[treenode] create {Category.__module__}.{Category.__name__} tree: "
-        )
-        with debug_performance(message_prefix=message_prefix):
-            with no_signals():
-                for i in range(2000):
-                    # cat_obj = Category.objects.create(
-                    Category.objects.create(name=f"{i}", tn_parent=None, tn_priority=0)
-                    # cat_parent_obj = cat_obj
-                    # for j in range(10):
-                    #     subcat_obj = Category.objects.create(
-                    #         name=f"{cat_obj} - {j}",
-                    #         tn_parent=cat_parent_obj,
-                    #         tn_priority=0,
-                    #     )
-                    #     cat_parent_obj = subcat_obj
+    def test_tree_shapes(self):
+        for shape in TREE_SHAPES:
+            parents = get_tree_parents(shape, 50)
+            self.assertEqual(len(parents), 50)
+            self.assertEqual(parents[0], None)
+            for i, parent in enumerate(parents):
+                self.assertTrue(parent is None or 0 <= parent < i)
+        self.assertEqual(get_tree_parents("flat", 5), [None] * 5)
+        self.assertEqual(get_tree_parents("deep", 3), [None, 0, 1])
 
+    def test_create_tree(self):
+        objs = create_tree(Category, "balanced", 21)
         Category.update_tree()
-        settings.DEBUG = False
+        self.assertEqual(Category.objects.count(), 21)
+        self.assertEqual(len(Category.get_roots()), 1)
+        root = Category.objects.get(pk=objs[0].pk)
+        self.assertEqual(root.get_descendants_count(), 20)
+        self.assertEqual(root.get_depth(), 2)
+
+    def test_measure(self):
+        calls = []
+        result = measure(lambda: calls.append(list(Category.objects.all())))
+        # timed once without tracing, then traced for queries and memory
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(result["queries"], 1)
+        self.assertGreater(result["memory_peak"], 0)
+        self.assertGreaterEqual(result["duration"], 0)
+
+    def test_performance(self):
+        shapes, sizes, output = get_benchmark_settings()
+        data = run_benchmark(Category, shapes=shapes, sizes=sizes or [50])
+        data_json = write_benchmark(data, output=output)
+        results = json.loads(data_json)["results"]
+        operations = {result["operation"] for result in results}
+        self.assertEqual(
+            operations,
+            {
+                "rebuild",
+                "cache_warm_up",
+                "init",
+                "init_non_tree",
+                "get_tree",
+                "get_descendants",
+                "relationship_checks",
+                "insert",
+                "move",
+                "delete",
+                "admin_changelist",
+            },
+        )
+        for result in results:
+            self.assertGreaterEqual(result["duration"], 0)
+            self.assertGreaterEqual(result["queries"], 0)
+            self.assertGreater(result["memory_peak"], 0)
+        indexes_results = json.loads(data_json)["indexes"]
+        queries = {result["query"] for result in indexes_results}
+        self.assertEqual(queries, {"roots", "level", "children", "ordering"})
+        plans = {}
+        for result in indexes_results:
+            self.assertEqual(result["queries"], 1)
+            plan_key = (result["shape"], result["size"], result["query"])
+            plans[(*plan_key, result["indexed"])] = result["plan"]
+        for shape, size, query, indexed in plans:
+            if indexed and query in ("roots", "level"):
+                # the full table scan is replaced by an index search
+                plan_key = (shape, size, query)
+                self.assertNotEqual(plans[(*plan_key, False)], plans[(*plan_key, True)])
@@ -0,0 +1,70 @@
+from django.test import TransactionTestCase
+
+from tests.models import CategoryWithCompactPks
+
+
+class TreeNodeCompactPksTestCase(TransactionTestCase):
+    def tearDown(self):
+        CategoryWithCompactPks.treenode_pks_encoding = "compact"
+        CategoryWithCompactPks.delete_tree()
+
+    def __create(self, name, parent=None):
+        return CategoryWithCompactPks.objects.create(name=name, tn_parent=parent)
+
+    def __create_tree(self):
+        a = self.__create("a")
+        aa = self.__create("aa", a)
+        aaa = self.__create("aaa", aa)
+        ab = self.__create("ab", a)
+        b = self.__create("b")
+        return [
+            CategoryWithCompactPks.objects.get(pk=obj.pk) for obj in [a, aa, aaa, ab, b]
+        ]
+
+    def test_compact_pks(self):
+        a, aa, aaa, ab, b = self.__create_tree()
+        self.assertTrue(a.tn_descendants_pks.startswith("~i"))
+        self.assertTrue(aaa.tn_ancestors_pks.startswith("~i"))
+        self.assertEqual(a.get_children_pks(), (aa.pk, ab.pk))
+        self.assertEqual(a.get_descendants_pks(), (aa.pk, aaa.pk, ab.pk))
+        self.assertEqual(aaa.get_ancestors_pks(), (a.pk, aa.pk))
+        self.assertEqual(aa.get_siblings_pks(), (ab.pk,))
+        self.assertEqual(aaa.get_root_pk(), a.pk)
+        self.assertEqual(a.get_descendants(), [aa, aaa, ab])
+        self.assertEqual(a.get_descendants(cache=False), [aa, aaa, ab])
+        self.assertTrue(aaa.is_descendant_of(a))
+        self.assertTrue(a.is_ancestor_of(aaa))
+        self.assertFalse(b.is_ancestor_of(aaa))
+        self.assertTrue(aa.is_sibling_of(ab))
+        self.assertEqual(len(CategoryWithCompactPks.get_tree()), 2)
+        self.assertEqual(CategoryWithCompactPks.check_tree(), {})
+
+    def test_switch_encoding(self):
+        # rows written with the text encoding are rewritten by the next update
+        CategoryWithCompactPks.treenode_pks_encoding = "text"
+        a, aa, aaa, ab, b = self.__create_tree()
+        self.assertEqual(a.tn_children_pks, f"{aa.pk},{ab.pk}")
+        CategoryWithCompactPks.treenode_pks_encoding = "compact"
+        a = CategoryWithCompactPks.objects.get(pk=a.pk)
+        self.assertEqual(a.get_children_pks(), (aa.pk, ab.pk))
+        self.assertEqual(a.get_children(), [aa, ab])
+        stats = CategoryWithCompactPks.update_tree()
+        self.assertEqual(stats.rows_changed, 5)
+        a.refresh_from_db()
+        self.assertTrue(a.tn_children_pks.startswith("~i"))
+        self.assertEqual(a.get_children_pks(), (aa.pk, ab.pk))
+
+    def test_switch_encoding_to_text(self):
+        # rows written with the compact encoding are decoded by their prefix
+        a, aa, aaa, ab, b = self.__create_tree()
+        CategoryWithCompactPks.treenode_pks_encoding = "text"
+        a = CategoryWithCompactPks.objects.get(pk=a.pk)
+        aaa = CategoryWithCompactPks.objects.get(pk=aaa.pk)
+        self.assertTrue(a.tn_children_pks.startswith("~i"))
+        self.assertEqual(a.get_children_pks(), (aa.pk, ab.pk))
+        self.assertEqual(a.get_descendants(), [aa, aaa, ab])
+        self.assertTrue(aaa.is_descendant_of(a))
+        stats = CategoryWithCompactPks.update_tree()
+        self.assertEqual(stats.rows_changed, 5)
+        a.refresh_from_db()
+        self.assertEqual(a.tn_children_pks, f"{aa.pk},{ab.pk}")
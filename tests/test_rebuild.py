@@ -0,0 +1,177 @@
+import threading
+
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from tests.models import Category
+from treenode.instrumentation import treenode_event
+from treenode.rebuild import run_pending_tree_updates
+
+scheduled_models = []
+
+
+def schedule_update(model, using, scope):
+    scheduled_models.append(model)
+
+
+class TreeNodeBackgroundUpdateTestCase(TransactionTestCase):
+    def setUp(self):
+        scheduled_models.clear()
+
+    def tearDown(self):
+        run_pending_tree_updates()
+        Category.delete_tree()
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_RUNNER="tests.test_rebuild.schedule_update",
+    )
+    def test_update_runner(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="b", tn_parent=a)
+        self.assertEqual(scheduled_models, [Category, Category])
+        self.assertTrue(Category.tree_is_dirty)
+        a.refresh_from_db()
+        self.assertEqual(a.tn_children_count, 0)
+        Category.update_tree()
+        self.assertFalse(Category.tree_is_dirty)
+        a.refresh_from_db()
+        self.assertEqual(a.tn_children_count, 1)
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_INTERVAL=60,
+    )
+    def test_update_pending(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="b", tn_parent=a)
+        Category.objects.create(name="c", tn_parent=a)
+        self.assertTrue(Category.is_tree_dirty())
+        # updates are coalesced in a single update per model
+        self.assertEqual(run_pending_tree_updates(), [Category])
+        self.assertEqual(run_pending_tree_updates(), [])
+        self.assertFalse(Category.is_tree_dirty())
+        self.assertEqual(a.tn_children_count, 2)
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_INTERVAL=0.01,
+    )
+    def test_update_worker(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="b", tn_parent=a)
+        for thread in threading.enumerate():
+            if thread.name == "treenode-update-worker":
+                thread.join(timeout=5)
+        self.assertFalse(Category.is_tree_dirty())
+        a.refresh_from_db()
+        self.assertEqual(a.tn_children_count, 1)
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_RUNNER="tests.test_rebuild.schedule_update",
+    )
+    def test_update_runner_after_commit(self):
+        with transaction.atomic():
+            Category.objects.create(name="a")
+            # the runner could read the old rows before the commit
+            self.assertEqual(scheduled_models, [])
+            self.assertFalse(Category.tree_is_dirty)
+        self.assertEqual(scheduled_models, [Category])
+        self.assertTrue(Category.tree_is_dirty)
+        Category.update_tree()
+        with transaction.atomic():
+            Category.objects.create(name="b")
+            transaction.set_rollback(True)
+        self.assertEqual(scheduled_models, [Category])
+        self.assertFalse(Category.tree_is_dirty)
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_INTERVAL=60,
+    )
+    def test_update_pending_error(self):
+        a = Category.objects.create(name="a")
+        Category.objects.filter(pk=a.pk).update(tn_parent=a.pk)
+        with self.assertLogs("treenode.rebuild", level="ERROR"):
+            self.assertEqual(run_pending_tree_updates(), [Category])
+        # the tree update failed, so the tree is still dirty
+        self.assertTrue(Category.is_tree_dirty())
+        Category.objects.filter(pk=a.pk).update(tn_parent=None)
+
+    @override_settings(TREENODE_UPDATE_MODE="invalid")
+    def test_invalid_update_mode(self):
+        with self.assertRaises(ValueError):
+            Category.objects.create(name="a")
+
+    def test_immediate_update(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="b", tn_parent=a)
+        self.assertFalse(Category.tree_is_dirty)
+        self.assertEqual(a.tn_children_count, 1)
+
+
+@override_settings(TREENODE_UPDATE_MODE="on_commit")
+class TreeNodeOnCommitUpdateTestCase(TransactionTestCase):
+    def setUp(self):
+        self.events = []
+        treenode_event.connect(self.__on_event, sender=Category)
+
+    def tearDown(self):
+        treenode_event.disconnect(self.__on_event, sender=Category)
+        Category.delete_tree()
+
+    def __on_event(self, sender, name, data, **kwargs):
+        if name == "rebuild_started":
+            self.events.append(name)
+
+    def test_update_once_after_commit(self):
+        with transaction.atomic():
+            a = Category.objects.create(name="a")
+            for name in ["b", "c", "d"]:
+                Category.objects.create(name=name, tn_parent=a)
+            self.assertEqual(len(self.events), 0)
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(a.tn_children_count, 3)
+
+    def test_no_update_after_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Category.objects.create(name="a")
+                raise ValueError()
+        self.assertEqual(len(self.events), 0)
+        self.assertEqual(Category.objects.count(), 0)
+
+    def test_update_after_savepoint_rollback(self):
+        with transaction.atomic():
+            a = Category.objects.create(name="a")
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Category.objects.create(name="b", tn_parent=a)
+                    raise ValueError()
+            Category.objects.create(name="c", tn_parent=a)
+        self.assertEqual(len(self.events), 1)
+        a.refresh_from_db()
+        self.assertEqual(a.tn_children_count, 1)
+
+    def test_update_without_transaction(self):
+        a = Category.objects.create(name="a")
+        self.assertEqual(len(self.events), 1)
+        Category.objects.create(name="b", tn_parent=a)
+        self.assertEqual(len(self.events), 2)
+        self.assertEqual(a.tn_children_count, 1)
+
+    def test_delete_and_set_parent_update_once_after_commit(self):
+        a = Category.objects.create(name="a")
+        b = Category.objects.create(name="b")
+        c = Category.objects.create(name="c")
+        d = Category.objects.create(name="d", tn_parent=a)
+        self.events = []
+        with transaction.atomic():
+            b.set_parent(a)
+            c.set_parent(a)
+            d.delete()
+            self.assertEqual(len(self.events), 0)
+        self.assertEqual(len(self.events), 1)
+        a.refresh_from_db()
+        self.assertEqual(a.get_children_pks(), (b.pk, c.pk))
@@ -0,0 +1,277 @@
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from tests.models import CategoryWithScope, CategoryWithTenant, Tenant
+from treenode.admin import TreeNodeModelAdmin
+from treenode.cache import delete_cached_dirty, get_cached_dirty, set_cached_dirty
+from treenode.instrumentation import treenode_event
+from treenode.rebuild import run_pending_tree_updates
+
+
+class TreeNodeScopeTestCase(TransactionTestCase):
+    def setUp(self):
+        self.events = []
+        treenode_event.connect(self.__on_event, sender=CategoryWithScope)
+
+    def tearDown(self):
+        treenode_event.disconnect(self.__on_event, sender=CategoryWithScope)
+        CategoryWithScope.delete_tree()
+
+    def __on_event(self, sender, name, data, **kwargs):
+        if name == "rebuild_finished":
+            self.events.append(data)
+
+    def __create(self, name, tenant, parent=None):
+        return CategoryWithScope.objects.create(
+            name=name, tenant=tenant, tn_parent=parent
+        )
+
+    def __get_names(self, objs):
+        return [obj.name for obj in objs]
+
+    def test_update_tree_scope(self):
+        a = self.__create("a", "x")
+        self.__create("aa", "x", a)
+        b = self.__create("b", "y")
+        self.__create("ba", "y", b)
+        self.__create("bb", "y", b)
+        self.events = []
+        self.__create("c", "x")
+        # only the nodes of the changed scope are loaded
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0]["nodes"], 3)
+
+    def test_scope_roots_and_order(self):
+        a = self.__create("a", "x")
+        b = self.__create("b", "y")
+        c = self.__create("c", "x")
+        for obj in [a, b, c]:
+            obj.refresh_from_db()
+        # roots of different scopes are not siblings
+        self.assertEqual(a.get_siblings_pks(), (c.pk,))
+        self.assertEqual(b.tn_siblings_count, 0)
+        self.assertEqual([a.tn_order, c.tn_order, b.tn_order], [0, 1, 0])
+        self.assertEqual([a.tn_index, c.tn_index, b.tn_index], [0, 1, 0])
+        roots = CategoryWithScope.get_roots(scope="x")
+        self.assertEqual(self.__get_names(roots), ["a", "c"])
+        roots = CategoryWithScope.get_roots(cache=False, scope="y")
+        self.assertEqual(self.__get_names(roots), ["b"])
+        self.assertEqual(len(CategoryWithScope.get_roots()), 3)
+
+    def test_scope_ordering(self):
+        a = self.__create("a", "y")
+        b = self.__create("b", "x")
+        self.__create("aa", "y", a)
+        self.__create("ba", "x", b)
+        self.__create("c", "y")
+        # tn_order is numbered per scope, the nodes of each scope stay together
+        self.assertEqual(CategoryWithScope._meta.ordering, ["tenant", "tn_order"])
+        names = self.__get_names(CategoryWithScope.objects.all())
+        self.assertEqual(names, ["b", "ba", "a", "aa", "c"])
+        self.assertEqual(
+            self.__get_names(CategoryWithScope.get_roots()), ["b", "a", "c"]
+        )
+        model_admin = TreeNodeModelAdmin(CategoryWithScope, admin.site)
+        self.assertEqual(model_admin.get_ordering(None), ("tenant", "tn_order"))
+
+    def test_scope_full_update(self):
+        a = self.__create("a", "x")
+        self.__create("b", "y")
+        self.__create("c", "x")
+        stats = CategoryWithScope.update_tree()
+        self.assertEqual(stats.nodes, 3)
+        self.assertEqual(stats.rows_changed, 0)
+        self.assertEqual(CategoryWithScope.check_tree(), {})
+        a.refresh_from_db()
+        self.assertEqual(a.tn_siblings_count, 1)
+
+    def test_scope_change(self):
+        a = self.__create("a", "x")
+        self.__create("b", "y")
+        c = self.__create("c", "x")
+        c = CategoryWithScope.objects.get(pk=c.pk)
+        c.tenant = "y"
+        c.save()
+        # both the previous and the new scope of the node are updated
+        self.assertEqual(
+            self.__get_names(CategoryWithScope.get_roots(scope="x")), ["a"]
+        )
+        roots = CategoryWithScope.get_roots(scope="y")
+        self.assertEqual(self.__get_names(roots), ["b", "c"])
+        a.refresh_from_db()
+        self.assertEqual(a.tn_siblings_count, 0)
+        self.assertEqual(CategoryWithScope.check_tree(), {})
+
+    def test_scope_change_with_children(self):
+        a = self.__create("a", "x")
+        self.__create("aa", "x", a)
+        a.refresh_from_db()
+        a.tenant = "y"
+        with self.assertRaises(ValueError):
+            a.save()
+
+    def test_scope_tree_and_cache(self):
+        a = self.__create("a", "x")
+        aa = self.__create("aa", "x", a)
+        self.__create("b", "y")
+        tree = CategoryWithScope.get_tree(scope="x")
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree[0]["node"].name, "a")
+        self.assertEqual(len(CategoryWithScope.get_tree()), 2)
+        self.assertIn(b'"display":"a"', CategoryWithScope.get_tree_json(scope="x"))
+        self.assertNotIn(b'"display":"b"', CategoryWithScope.get_tree_json(scope="x"))
+        objs_walk = CategoryWithScope.walk_tree(order="level", scope="y")
+        names = [obj.name for obj, _depth, _event in objs_walk]
+        self.assertEqual(names, ["b"])
+        a.refresh_from_db()
+        self.assertEqual(self.__get_names(a.get_children()), ["aa"])
+        self.assertEqual(aa.get_root().name, "a")
+        # a change in a scope refreshes the cached nodes of all the scopes
+        self.__create("ab", "x", a)
+        a.refresh_from_db()
+        self.assertEqual(self.__get_names(a.get_children()), ["aa", "ab"])
+        self.assertEqual(len(CategoryWithScope._get_all()), 4)
+
+    def test_scope_indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, CategoryWithScope._meta.db_table
+            )
+        indexes = [
+            constraint["columns"]
+            for constraint in constraints.values()
+            if constraint["index"]
+        ]
+        self.assertIn(["tenant", "tn_order"], indexes)
+        self.assertIn(["tenant", "tn_ancestors_count"], indexes)
+        self.assertIn(["tn_parent_id", "tn_order"], indexes)
+        self.assertIn(["tenant", "tn_level"], indexes)
+
+    def test_set_parent_scope(self):
+        a = self.__create("a", "x")
+        b = self.__create("b", "y")
+        with self.assertRaises(ValueError):
+            b.set_parent(a)
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_INTERVAL=60,
+    )
+    def test_background_update_scope(self):
+        self.__create("a", "x")
+        self.__create("b", "y")
+        self.assertTrue(CategoryWithScope.is_tree_dirty(scope="x"))
+        self.assertTrue(CategoryWithScope.is_tree_dirty(scope="y"))
+        self.assertFalse(CategoryWithScope.is_tree_dirty(scope="z"))
+        self.assertTrue(CategoryWithScope.tree_is_dirty)
+        CategoryWithScope.update_tree(scope="x")
+        self.assertFalse(CategoryWithScope.is_tree_dirty(scope="x"))
+        # the tree is dirty until all the dirty scopes are updated
+        self.assertTrue(CategoryWithScope.tree_is_dirty)
+        self.assertEqual(
+            run_pending_tree_updates(), [CategoryWithScope, CategoryWithScope]
+        )
+        self.assertFalse(CategoryWithScope.is_tree_dirty(scope="x"))
+        self.assertFalse(CategoryWithScope.is_tree_dirty(scope="y"))
+        self.assertFalse(CategoryWithScope.tree_is_dirty)
+
+    @override_settings(
+        TREENODE_UPDATE_MODE="background",
+        TREENODE_UPDATE_INTERVAL=60,
+    )
+    def test_background_full_update_scope(self):
+        self.__create("a", "x")
+        self.__create("b", "y")
+        CategoryWithScope.update_tree()
+        # all the scopes are updated
+        self.assertFalse(CategoryWithScope.is_tree_dirty(scope="x"))
+        self.assertFalse(CategoryWithScope.tree_is_dirty)
+        run_pending_tree_updates()
+
+    def test_dirty_scopes_keys(self):
+        set_cached_dirty(CategoryWithScope, scope="x")
+        set_cached_dirty(CategoryWithScope, scope="x")
+        set_cached_dirty(CategoryWithScope, scope="y")
+        # each scope has its own key, counted once
+        delete_cached_dirty(CategoryWithScope, scope="x")
+        self.assertFalse(get_cached_dirty(CategoryWithScope, scope="x"))
+        self.assertTrue(get_cached_dirty(CategoryWithScope, scope="y"))
+        self.assertTrue(get_cached_dirty(CategoryWithScope))
+        delete_cached_dirty(CategoryWithScope, scope="y")
+        self.assertFalse(get_cached_dirty(CategoryWithScope))
+        # all the scopes stay dirty until they are updated together
+        set_cached_dirty(CategoryWithScope)
+        delete_cached_dirty(CategoryWithScope, scope="x")
+        self.assertTrue(get_cached_dirty(CategoryWithScope, scope="x"))
+        self.assertTrue(get_cached_dirty(CategoryWithScope))
+        delete_cached_dirty(CategoryWithScope)
+        self.assertFalse(get_cached_dirty(CategoryWithScope, scope="x"))
+        self.assertFalse(get_cached_dirty(CategoryWithScope))
+
+    def test_parent_scope(self):
+        a = self.__create("a", "x")
+        with self.assertRaises(ValueError):
+            self.__create("aa", "y", a)
+        b = CategoryWithScope(name="b", tenant="y", tn_parent=a)
+        with self.assertRaises(ValidationError) as context:
+            b.full_clean()
+        self.assertIn("tn_parent", context.exception.message_dict)
+        b.tenant = "x"
+        b.full_clean()
+        b.save()
+        self.assertEqual(a.get_children_pks(), (b.pk,))
+
+    def test_bulk_create_tree_scope(self):
+        a = self.__create("a", "x")
+        with self.assertRaises(ValueError):
+            CategoryWithScope.bulk_create_tree(
+                [{"name": "aa", "tenant": "y"}], parent=a
+            )
+        with self.assertRaises(ValueError):
+            CategoryWithScope.bulk_create_tree(
+                [{"name": "b", "tenant": "y", "children": [{"name": "ba"}]}]
+            )
+        self.assertEqual(CategoryWithScope.objects.count(), 1)
+        objs = CategoryWithScope.bulk_create_tree(
+            [
+                {
+                    "name": "aa",
+                    "tenant": "x",
+                    "children": [{"name": "aaa", "tenant": "x"}],
+                }
+            ],
+            parent=a,
+        )
+        self.assertEqual(objs[1].get_ancestors_pks(), (a.pk, objs[0].pk))
+
+    def test_copy_subtree_scope(self):
+        a = self.__create("a", "x")
+        self.__create("aa", "x", a)
+        b = self.__create("b", "y")
+        with self.assertRaises(ValueError):
+            a.copy_subtree(parent=b)
+        a_copy = a.copy_subtree(parent=b, field_overrides={"tenant": "y"})
+        self.assertEqual(a_copy.tn_parent, b)
+        self.assertEqual(
+            self.__get_names(a_copy.get_descendants()),
+            ["aa"],
+        )
+        self.assertEqual(a_copy.get_descendants()[0].tenant, "y")
+
+    def test_copy_subtree_scope_foreign_key(self):
+        x = Tenant.objects.create(name="x")
+        y = Tenant.objects.create(name="y")
+        a = CategoryWithTenant.objects.create(name="a", tenant=x)
+        CategoryWithTenant.objects.create(name="aa", tenant=x, tn_parent=a)
+        # foreign keys can be overridden by name (with instances) or attname
+        a_copy = a.copy_subtree(field_overrides={"tenant": y})
+        self.assertEqual(a_copy.tenant, y)
+        self.assertEqual(a_copy.get_descendants()[0].tenant_id, y.pk)
+        a_copy = a.copy_subtree(field_overrides={"tenant_id": y.pk})
+        self.assertEqual(a_copy.tenant, y)
+        roots = CategoryWithTenant.get_roots(scope=y.pk)
+        self.assertEqual([obj.name for obj in roots], ["a", "a"])
+        CategoryWithTenant.delete_tree()
+        Tenant.objects.all().delete()
@@ -1,10 +1,15 @@
 from contextlib import contextmanager
 
+from django.contrib.auth.models import Group
 from django.core.management.sql import emit_post_migrate_signal
 from django.db import OperationalError, ProgrammingError, connection
+from django.db.models.signals import post_delete, post_init, post_save
 from django.test import TransactionTestCase
 
-from tests.models import Category
+from tests.models import AbstractCategoryProxy, Category
+from treenode.instrumentation import treenode_event
+from treenode.models import TreeNodeVersion
+from treenode.signals import no_signals
 
 ModelToBeDestroyed = Category
 
@@ -79,3 +84,58 @@ class TreeNodeAbstractProxyTestCase(TransactionTestCase):
                 interactive=False,
                 db=connection.alias,
             )
+
+
+class TreeNodeChecksumPostMigrateTestCase(TransactionTestCase):
+    def setUp(self):
+        self.events = []
+        treenode_event.connect(self.__on_event, sender=Category)
+
+    def tearDown(self):
+        treenode_event.disconnect(self.__on_event, sender=Category)
+
+    def __on_event(self, sender, name, data, **kwargs):
+        self.events.append(name)
+
+    def __emit_post_migrate_signal(self):
+        self.events = []
+        emit_post_migrate_signal(
+            verbosity=0,
+            interactive=False,
+            db=connection.alias,
+        )
+        return self.events.count("rebuild_started")
+
+    def test_post_migrate_skips_unchanged_tree(self):
+        a = Category.objects.create(name="a")
+        Category.objects.create(name="b", tn_parent=a)
+        self.assertEqual(self.__emit_post_migrate_signal(), 0)
+
+    def test_post_migrate_updates_changed_tree(self):
+        a = Category.objects.create(name="a")
+        b = Category.objects.create(name="b", tn_parent=a)
+        with no_signals():
+            Category.objects.filter(pk=b.pk).update(tn_level=5)
+        self.assertEqual(self.__emit_post_migrate_signal(), 1)
+        self.assertEqual(Category.objects.get(pk=b.pk).tn_level, 2)
+        self.assertEqual(self.__emit_post_migrate_signal(), 0)
+
+    def test_post_migrate_updates_tree_without_checksum(self):
+        Category.objects.create(name="a")
+        TreeNodeVersion.objects.all().update(checksum="")
+        self.assertEqual(self.__emit_post_migrate_signal(), 1)
+        self.assertEqual(self.__emit_post_migrate_signal(), 0)
+
+
+class TreeNodeSignalsSendersTestCase(TransactionTestCase):
+    def test_signals_connected_to_treenode_models_only(self):
+        for signal in [post_init, post_save, post_delete]:
+            self.assertTrue(signal.has_listeners(Category))
+            self.assertFalse(signal.has_listeners(AbstractCategoryProxy))
+            self.assertFalse(signal.has_listeners(Group))
+
+    def test_no_signals(self):
+        with no_signals():
+            for signal in [post_init, post_save, post_delete]:
+                self.assertFalse(signal.has_listeners(Category))
+        self.assertTrue(post_init.has_listeners(Category))
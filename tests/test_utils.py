@@ -1,6 +1,8 @@
+import uuid
+
 from django.test import TestCase
 
-from treenode.utils import contains_pk, join_pks, split_pks
+from treenode.utils import contains_pk, join_pks, parse_pks, split_pks
 
 
 class TreeNodeUtilsTestCase(TestCase):
@@ -18,6 +20,10 @@ class TreeNodeUtilsTestCase(TestCase):
         self.assertEqual(contains_pk("0,1", 1), True)
         self.assertEqual(contains_pk("0,1,2", 1), True)
         self.assertEqual(contains_pk("0,2,3", 1), False)
+        self.assertEqual(contains_pk("10,11,21", 1), False)
+        self.assertEqual(contains_pk("10,11,1", 1), True)
+        self.assertEqual(contains_pk("a b,c", "a b"), True)
+        self.assertEqual(contains_pk("a b,c", "b"), False)
 
     def test_join_pks(self):
         pks_str = join_pks(None)
@@ -27,6 +33,47 @@ class TreeNodeUtilsTestCase(TestCase):
         pks_str = join_pks([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
         self.assertEqual(pks_str, "0,1,2,3,4,5,6,7,8,9,10")
 
+    def test_parse_pks(self):
+        self.assertEqual(parse_pks(None), ())
+        self.assertEqual(parse_pks("1,2"), ("1", "2"))
+        self.assertEqual(parse_pks("1,2", int), (1, 2))
+        pk = uuid.uuid4()
+        self.assertEqual(parse_pks(f"{pk}", uuid.UUID), (pk,))
+
+    def test_compact_pks(self):
+        for pks in [[1], [1, 2, 3], [300, 5, 1000000, 4, 4], [2**40, 0]]:
+            s = join_pks(pks, encoding="compact")
+            self.assertTrue(s.startswith("~i"))
+            self.assertEqual(parse_pks(s, encoding="compact"), tuple(pks))
+            self.assertEqual(split_pks(s, encoding="compact"), [str(v) for v in pks])
+            self.assertEqual(contains_pk(s, pks[-1], encoding="compact"), True)
+            self.assertEqual(contains_pk(s, 7, encoding="compact"), False)
+        pks = [uuid.uuid4() for _ in range(3)]
+        s = join_pks(pks, encoding="compact")
+        self.assertTrue(s.startswith("~u"))
+        self.assertEqual(parse_pks(s, encoding="compact"), tuple(pks))
+        self.assertEqual(contains_pk(s, pks[1], encoding="compact"), True)
+        # shorter than the text encoding
+        self.assertLess(len(s), len(join_pks(pks)))
+        self.assertLess(
+            len(join_pks(range(1000, 2000), encoding="compact")),
+            len(join_pks(range(1000, 2000))) / 2,
+        )
+        # text encoded pks can still be decoded
+        self.assertEqual(parse_pks("1,2", int, encoding="compact"), (1, 2))
+        # and compact encoded pks are decoded whatever the encoding
+        s = join_pks([3, 1, 2], encoding="compact")
+        self.assertEqual(parse_pks(s, int, encoding="text"), (3, 1, 2))
+        self.assertEqual(parse_pks(s), (3, 1, 2))
+        self.assertEqual(split_pks(s), ["3", "1", "2"])
+        self.assertEqual(contains_pk(s, 2), True)
+        self.assertEqual(parse_pks("~ia,~ib"), ("~ia", "~ib"))
+        self.assertEqual(join_pks([], encoding="compact"), "")
+        with self.assertRaises(ValueError):
+            join_pks(["a"], encoding="compact")
+        with self.assertRaises(ValueError):
+            join_pks([1], encoding="invalid")
+
     def test_split_pks(self):
         pks_list = split_pks(None)
         self.assertEqual(pks_list, [])
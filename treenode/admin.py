@@ -57,6 +57,14 @@ class TreeNodeModelAdmin(admin.ModelAdmin):
 
         return base_list_display
 
+    def get_ordering(self, request):
+        ordering = super().get_ordering(request)
+        scope_field = self.model.treenode_scope_field
+        if scope_field and tuple(ordering) == ("tn_order",):
+            # tn_order is numbered per scope
+            ordering = (scope_field, "tn_order")
+        return ordering
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         qs = qs.select_related("tn_parent")
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class TreeNodeConfig(AppConfig):
+    name = "treenode"
+    verbose_name = _("Tree Node")
+    default_auto_field = "django.db.models.AutoField"
@@ -1,11 +1,14 @@
+import hashlib
 import logging
 from collections import defaultdict
 
 from django.conf import settings
 from django.core.cache import cache as default_cache
 from django.core.cache import caches
+from django.db import router
 
 from treenode.exceptions import CacheError
+from treenode.instrumentation import get_size, is_instrumentation_enabled, send_event
 from treenode.utils import split_pks
 
 logger = logging.getLogger(__name__)
@@ -19,12 +22,43 @@ def _get_cache_name():
     return "treenode" if "treenode" in settings.CACHES else "default"
 
 
-def _get_cached_collection(key, dict_cls):
+def _cache_get(key, model=None):
     c = _get_cache()
     value = c.get(key, None)
+    if is_instrumentation_enabled(model):
+        event_name = "cache_miss" if value is None else "cache_hit"
+        send_event(event_name, model, key=key)
+    return value
+
+
+def _cache_set(key, value, model=None):
+    c = _get_cache()
+    c.set(key, value)
+    if is_instrumentation_enabled(model):
+        send_event("cache_set", model, key=key, bytes=get_size(value))
+
+
+async def _acache_get(key, model=None):
+    c = _get_cache()
+    value = await c.aget(key, None)
+    if is_instrumentation_enabled(model):
+        event_name = "cache_miss" if value is None else "cache_hit"
+        send_event(event_name, model, key=key)
+    return value
+
+
+async def _acache_set(key, value, model=None):
+    c = _get_cache()
+    await c.aset(key, value)
+    if is_instrumentation_enabled(model):
+        send_event("cache_set", model, key=key, bytes=get_size(value))
+
+
+def _get_cached_collection(key, dict_cls):
+    value = _cache_get(key)
     if value is None:
         value = defaultdict(dict_cls)
-        c.set(key, value)
+        _cache_set(key, value)
     return value
 
 
@@ -35,45 +69,266 @@ def _get_cached_collections():
 
 
 def _set_cached_collections(ls, d):
+    _cache_set("treenode_list", ls)
+    _cache_set("treenode_dict", d)
+
+
+async def _aget_cached_collection(key, dict_cls):
+    value = await _acache_get(key)
+    if value is None:
+        value = defaultdict(dict_cls)
+        await _acache_set(key, value)
+    return value
+
+
+async def _aget_cached_collections():
+    ls = await _aget_cached_collection("treenode_list", list)
+    d = await _aget_cached_collection("treenode_dict", dict)
+    return (ls, d)
+
+
+async def _aset_cached_collections(ls, d):
+    await _acache_set("treenode_list", ls)
+    await _acache_set("treenode_dict", d)
+
+
+def _get_db(cls, using=None):
+    # the alias of the database where the tree is written,
+    # trees read from replicas are cached with the same alias
+    return using or router.db_for_write(cls)
+
+
+def _get_tree_key(cls, using=None, scope=None):
+    return (cls, _get_db(cls, using), scope)
+
+
+def _get_hash(value):
+    # hash values to always get a valid cache key (eg. string pks with spaces)
+    return hashlib.md5(str(value).encode("utf-8"), usedforsecurity=False).hexdigest()
+
+
+def _get_read_db(cls, db):
+    # the tree of the database for write is read from the database for read
+    # (eg. a replica), the trees of other databases are read from them
+    return router.db_for_read(cls) if db == router.db_for_write(cls) else db
+
+
+def _get_queryset(cls, using=None, read_using=None, scope=None):
+    read_db = read_using or _get_read_db(cls, _get_db(cls, using))
+    return cls._filter_scope(cls.objects.using(read_db).all(), scope)
+
+
+def _get_cached_objs(key, ls, d, pk=None, pks=None):
+    if pk is not None:
+        return d[key].get(str(pk))
+    elif pks is not None:
+        if isinstance(pks, str):
+            pks = split_pks(pks, encoding=key[0].treenode_pks_encoding)
+        return [d[key].get(str(pk)) for pk in pks]
+    else:
+        return list(ls[key])
+
+
+def _set_cached_objs(key, ls, d, objs):
+    ls[key] = objs
+    d[key] = {str(obj.pk): obj for obj in objs}
+    cls, db, scope = key
+    if cls.treenode_scope_field:
+        # the nodes of all scopes and the nodes of each scope
+        # are cached separately, the outdated ones are removed
+        for other_key in list(ls.keys()):
+            other_cls, other_db, other_scope = other_key
+            if other_cls is not cls or other_db != db or other_key == key:
+                continue
+            if scope is None or other_scope is None:
+                ls.pop(other_key, None)
+                d.pop(other_key, None)
+
+
+def _check_cached_objs(key, ls, d, objs):
+    # ensure cache has been updated correctly
+    if len(objs) and (not ls[key] or not d[key]):
+        cn = _get_cache_name()
+        msg = (
+            f"Unable to update cache '{cn}', "
+            "please check 'settings.CACHES' configuration."
+        )
+        logger.warning(msg)
+        raise CacheError(msg)
+
+
+def _get_tree_json_key(cls, version, pk=None, using=None, scope=None):
+    db = _get_db(cls, using)
+    key = f"treenode_json_{db}_{cls._meta.label_lower}_{version}"
+    if pk is not None:
+        key = f"{key}_{_get_hash(pk)}"
+    elif scope is not None:
+        key = f"{key}_scope_{_get_hash(scope)}"
+    return key
+
+
+def _get_version_key(cls, using=None):
+    db = _get_db(cls, using)
+    return f"treenode_version_{db}_{cls._meta.concrete_model._meta.label_lower}"
+
+
+def _get_dirty_key(cls, using=None):
+    db = _get_db(cls, using)
+    return f"treenode_dirty_{db}_{cls._meta.concrete_model._meta.label_lower}"
+
+
+def _cache_incr(key, delta=1):
+    # atomic on the cache backends supporting it, keys never expire
     c = _get_cache()
-    c.set("treenode_list", ls)
-    c.set("treenode_dict", d)
+    c.add(key, 0, timeout=None)
+    try:
+        return c.incr(key, delta)
+    except ValueError:
+        # the key has been evicted meanwhile
+        return None
+
+
+def _get_dirty_generation(cls, using=None):
+    # updating all the scopes starts a new generation of dirty keys
+    return _cache_get(_get_dirty_key(cls, using), model=cls) or 0
+
+
+def _get_dirty_scope_key(cls, generation, using=None, scope=None):
+    # each dirty scope has its own key, None stands for all the scopes
+    key = f"{_get_dirty_key(cls, using)}_{generation}"
+    return f"{key}_all" if scope is None else f"{key}_scope_{_get_hash(scope)}"
+
 
+def _get_dirty_count_key(cls, generation, using=None):
+    return f"{_get_dirty_key(cls, using)}_{generation}_count"
 
-def clear_cache(cls):
+
+def clear_cache(cls, using=None):
+    # clear the cached nodes of all the scopes
+    db = _get_db(cls, using)
     ls, d = _get_cached_collections()
-    del ls[cls][:]
-    d[cls].clear()
+    for key in list(ls.keys()):
+        if key[0] is cls and key[1] == db:
+            ls.pop(key, None)
+            d.pop(key, None)
     _set_cached_collections(ls, d)
 
 
-def query_cache(cls, pk=None, pks=None):
+def delete_cached_dirty(cls, using=None, scope=None):
+    if scope is None:
+        # updating all the scopes updates each one of them,
+        # while all the scopes stay dirty until they are updated together
+        _cache_incr(_get_dirty_key(cls, using))
+        return
+    generation = _get_dirty_generation(cls, using)
+    scope_key = _get_dirty_scope_key(cls, generation, using=using, scope=scope)
+    if _get_cache().delete(scope_key):
+        _cache_incr(_get_dirty_count_key(cls, generation, using=using), -1)
+
+
+def delete_cached_tree_json(cls, version, pk=None, using=None, scope=None):
+    key = _get_tree_json_key(cls, version, pk=pk, using=using, scope=scope)
+    _get_cache().delete(key)
+
+
+def get_cached_dirty(cls, using=None, scope=None):
+    generation = _get_dirty_generation(cls, using)
+    if scope is None:
+        # the tree is dirty if any of its scopes is dirty
+        count_key = _get_dirty_count_key(cls, generation, using=using)
+        return (_cache_get(count_key, model=cls) or 0) > 0
+    keys = [
+        _get_dirty_scope_key(cls, generation, using=using, scope=scope),
+        _get_dirty_scope_key(cls, generation, using=using),
+    ]
+    return any(_cache_get(key, model=cls) for key in keys)
+
+
+def get_cached_tree_json(cls, version, pk=None, using=None, scope=None):
+    key = _get_tree_json_key(cls, version, pk=pk, using=using, scope=scope)
+    return _cache_get(key, model=cls)
+
+
+async def aget_cached_tree_json(cls, version, pk=None, using=None, scope=None):
+    key = _get_tree_json_key(cls, version, pk=pk, using=using, scope=scope)
+    return await _acache_get(key, model=cls)
+
+
+def get_cached_version(cls, using=None):
+    return _cache_get(_get_version_key(cls, using), model=cls)
+
+
+async def aget_cached_version(cls, using=None):
+    return await _acache_get(_get_version_key(cls, using), model=cls)
+
+
+def query_cache(cls, pk=None, pks=None, using=None, scope=None):
+    key = _get_tree_key(cls, using, scope)
     ls, d = _get_cached_collections()
-    if not ls[cls] or not d[cls]:
-        update_cache(cls)
+    if not ls[key] or not d[key]:
+        update_cache(cls, using=using, scope=scope)
         ls, d = _get_cached_collections()
-    if pk is not None:
-        return d[cls].get(str(pk))
-    elif pks is not None:
-        return [d[cls].get(str(pk)) for pk in split_pks(pks)]
-    else:
-        return list(ls[cls])
+    return _get_cached_objs(key, ls, d, pk=pk, pks=pks)
+
+
+async def aquery_cache(cls, pk=None, pks=None, using=None, scope=None):
+    key = _get_tree_key(cls, using, scope)
+    ls, d = await _aget_cached_collections()
+    if not ls[key] or not d[key]:
+        await aupdate_cache(cls, using=using, scope=scope)
+        ls, d = await _aget_cached_collections()
+    return _get_cached_objs(key, ls, d, pk=pk, pks=pks)
 
 
-def update_cache(cls):
-    objs = list(cls.objects.all())
+def update_cache(cls, using=None, read_using=None, scope=None):
+    """
+    Caches all the nodes of the tree of the given database alias
+    (router.db_for_write by default) and scope (all scopes by default),
+    nodes are read from read_using or from the database for read
+    (eg. a replica) of the model.
+    """
+    key = _get_tree_key(cls, using, scope)
+    objs = list(_get_queryset(cls, using, read_using, scope))
     ls, d = _get_cached_collections()
-    ls[cls] = objs
-    d[cls] = {str(obj.pk): obj for obj in objs}
+    _set_cached_objs(key, ls, d, objs)
     _set_cached_collections(ls, d)
-    # ensure cache has been updated correctly
     if len(objs):
         ls, d = _get_cached_collections()
-        if not ls[cls] or not d[cls]:
-            cn = _get_cache_name()
-            msg = (
-                f"Unable to update cache '{cn}', "
-                "please check 'settings.CACHES' configuration."
-            )
-            logger.warning(msg)
-            raise CacheError(msg)
+        _check_cached_objs(key, ls, d, objs)
+
+
+async def aupdate_cache(cls, using=None, read_using=None, scope=None):
+    key = _get_tree_key(cls, using, scope)
+    objs = [obj async for obj in _get_queryset(cls, using, read_using, scope)]
+    ls, d = await _aget_cached_collections()
+    _set_cached_objs(key, ls, d, objs)
+    await _aset_cached_collections(ls, d)
+    if len(objs):
+        ls, d = await _aget_cached_collections()
+        _check_cached_objs(key, ls, d, objs)
+
+
+def set_cached_dirty(cls, using=None, scope=None):
+    generation = _get_dirty_generation(cls, using)
+    scope_key = _get_dirty_scope_key(cls, generation, using=using, scope=scope)
+    # the scope key is added once, so each dirty scope is counted once
+    if _get_cache().add(scope_key, True, timeout=None):
+        _cache_incr(_get_dirty_count_key(cls, generation, using=using))
+
+
+def set_cached_tree_json(cls, version, data, pk=None, using=None, scope=None):
+    key = _get_tree_json_key(cls, version, pk=pk, using=using, scope=scope)
+    _cache_set(key, data, model=cls)
+
+
+async def aset_cached_tree_json(cls, version, data, pk=None, using=None, scope=None):
+    key = _get_tree_json_key(cls, version, pk=pk, using=using, scope=scope)
+    await _acache_set(key, data, model=cls)
+
+
+def set_cached_version(cls, version, using=None):
+    _cache_set(_get_version_key(cls, using), version, model=cls)
+
+
+async def aset_cached_version(cls, version, using=None):
+    await _acache_set(_get_version_key(cls, using), version, model=cls)
@@ -1,20 +1,22 @@
+import cProfile
 import logging
+import os
+import tempfile
 import timeit
 
 from django.conf import settings
-from django.db import connection
+from django.utils import timezone
+
+from treenode.instrumentation import count_queries
 
 logger = logging.getLogger(__name__)
 
 
 class debug_performance:
-    def __init__(self, message_prefix=""):
+    def __init__(self, message_prefix="", stats=None):
         super().__init__()
         self.__message_prefix = message_prefix
-
-    @staticmethod
-    def _get_queries():
-        return len(connection.queries)
+        self.__stats = stats
 
     @staticmethod
     def _get_timer():
@@ -23,7 +25,8 @@ class debug_performance:
     def __enter__(self):
         if not settings.DEBUG:
             return None
-        self.__init_queries = debug_performance._get_queries()
+        # connection.queries is capped, count queries using an execute wrapper
+        self.__queries = count_queries().__enter__()
         self.__init_timer = debug_performance._get_timer()
         return None
 
@@ -31,8 +34,113 @@ class debug_performance:
         if not settings.DEBUG:
             return
         prefix = self.__message_prefix
-        queries = debug_performance._get_queries() - self.__init_queries
+        self.__queries.__exit__(type_, value, traceback)
+        queries = self.__queries.count
         queries_label = "query" if queries == 1 else "queries"
         timer = debug_performance._get_timer() - self.__init_timer
         message = f"\r{prefix}executed {queries} {queries_label} in {timer}s."
+        if self.__stats is not None and self.__stats.phases:
+            message += f" ({self.__stats})"
         logger.debug(message)
+
+
+class profile_performance:
+    """
+    Profiles the code block using cProfile if settings.TREENODE_PROFILE_THRESHOLD
+    (seconds) is set, the profile is saved in settings.TREENODE_PROFILE_DIR
+    (default: temp directory) only if the block lasted more than the threshold.
+    """
+
+    def __init__(self, name, stats=None):
+        super().__init__()
+        self.__name = name
+        self.__stats = stats
+        self.__profiler = None
+
+    def __enter__(self):
+        self.__threshold = getattr(settings, "TREENODE_PROFILE_THRESHOLD", None)
+        if self.__threshold is None:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is already active
+            return None
+        self.__profiler = profiler
+        self.__init_timer = timeit.default_timer()
+        return None
+
+    def __exit__(self, type_, value, traceback):
+        profiler = self.__profiler
+        if profiler is None:
+            return
+        profiler.disable()
+        self.__profiler = None
+        timer = timeit.default_timer() - self.__init_timer
+        if timer < self.__threshold:
+            return
+        profile_dir = getattr(settings, "TREENODE_PROFILE_DIR", None)
+        profile_dir = profile_dir or tempfile.gettempdir()
+        profile_date = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        profile_path = os.path.join(
+            profile_dir, f"treenode-{self.__name}-{profile_date}.prof"
+        )
+        profiler.dump_stats(profile_path)
+        if self.__stats is not None:
+            self.__stats.profile_path = profile_path
+        logger.info(
+            f"[treenode] {self.__name} took {timer}s, profile saved to {profile_path}"
+        )
+
+
+class TreeUpdateStats:
+    """
+    Collects the duration of each update_tree phase and the changes counters.
+    """
+
+    def __init__(self, model=None, dry_run=False):
+        super().__init__()
+        self.model = model
+        self.dry_run = dry_run
+        self.changes = {}
+        self.nodes = 0
+        self.duration = 0.0
+        self.phases = {}
+        self.checksum = None
+        self.profile_path = None
+        self.__phase = None
+        self.__phase_timer = None
+
+    @property
+    def rows_changed(self):
+        return len(self.changes)
+
+    @property
+    def fields_changed(self):
+        return sum(len(obj_data) for obj_data in self.changes.values())
+
+    def start_phase(self, name):
+        self.end_phase()
+        self.__phase = name
+        self.__phase_timer = timeit.default_timer()
+
+    def end_phase(self):
+        if self.__phase is None:
+            return
+        timer = timeit.default_timer() - self.__phase_timer
+        self.phases[self.__phase] = self.phases.get(self.__phase, 0.0) + timer
+        self.__phase = None
+
+    def to_dict(self):
+        return {
+            "nodes": self.nodes,
+            "rows_changed": self.rows_changed,
+            "fields_changed": self.fields_changed,
+            "dry_run": self.dry_run,
+            "duration": self.duration,
+            "phases": dict(self.phases),
+        }
+
+    def __str__(self):
+        return ", ".join(f"{name}: {timer:.6f}s" for name, timer in self.phases.items())
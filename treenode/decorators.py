@@ -0,0 +1,54 @@
+import hashlib
+
+from django.views.decorators.http import condition
+
+
+def get_tree_etag(*models):
+    """
+    Returns an etag computed from the tree versions of the given models,
+    it changes every time one of the trees is updated.
+    """
+    versions = []
+    for model in models:
+        label = model._meta.concrete_model._meta.label_lower
+        version = model.get_tree_version()
+        last_modified = model.get_tree_last_modified()
+        last_modified = last_modified.isoformat() if last_modified else ""
+        versions.append(f"{label}:{version}:{last_modified}")
+    versions_str = ";".join(versions)
+    return hashlib.md5(versions_str.encode("utf-8"), usedforsecurity=False).hexdigest()
+
+
+def get_tree_last_modified(*models):
+    """
+    Returns the most recent tree update datetime of the given models.
+    """
+    dates = [model.get_tree_last_modified() for model in models]
+    dates = [date for date in dates if date is not None]
+    return max(dates) if dates else None
+
+
+def tree_condition(*models):
+    """
+    Usage:
+
+    from treenode.decorators import tree_condition
+    from .models import Category
+
+
+    @tree_condition(Category)
+    def categories_menu(request):
+        ...
+
+    The view is executed only if the tree of the given models
+    has been updated since the client last request, otherwise
+    a 304 Not Modified response is returned using ETag/Last-Modified headers.
+    """
+
+    def etag_func(request, *args, **kwargs):
+        return get_tree_etag(*models)
+
+    def last_modified_func(request, *args, **kwargs):
+        return get_tree_last_modified(*models)
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
@@ -1,7 +1,5 @@
 from django import forms
 
-from treenode.utils import split_pks
-
 
 class TreeNodeForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
@@ -12,7 +10,7 @@ class TreeNodeForm(forms.ModelForm):
         obj = self.instance
         if obj.pk:
             exclude_pks += [obj.pk]
-            exclude_pks += split_pks(obj.tn_descendants_pks)
+            exclude_pks += obj.get_descendants_pks()
         manager = obj.__class__.objects
         self.fields["tn_parent"].queryset = manager.prefetch_related(
             "tn_children"
@@ -0,0 +1,19 @@
+from django.db import models
+
+
+def get_tree_indexes(scope_field=None):
+    """
+    Returns the recommended indexes for the tree fields, to be added to the
+    model Meta.indexes (they are not added by default to avoid unexpected
+    migrations): tn_order (ordering), tn_ancestors_count (roots),
+    (tn_parent, tn_order) (ordered children) and tn_level (levels).
+    If scope_field is given (the model treenode_scope_field), it is prepended
+    to the indexes not filtering by parent.
+    """
+    prefix = [scope_field] if scope_field else []
+    return [
+        models.Index(fields=[*prefix, "tn_order"]),
+        models.Index(fields=[*prefix, "tn_ancestors_count"]),
+        models.Index(fields=["tn_parent", "tn_order"]),
+        models.Index(fields=[*prefix, "tn_level"]),
+    ]
@@ -0,0 +1,120 @@
+import logging
+import pickle
+import timeit
+from contextlib import ExitStack
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# sent with name (eg. "rebuild_finished") and data (dict) arguments,
+# the sender is the TreeNodeModel subclass (None for shared cache events)
+treenode_event = Signal()
+
+
+@lru_cache
+def _import_events_handler(path):
+    return import_string(path)
+
+
+def _get_events_handler():
+    path = getattr(settings, "TREENODE_EVENTS_HANDLER", None)
+    return _import_events_handler(path) if path else None
+
+
+def is_instrumentation_enabled(model=None):
+    # the model is passed as sender, so receivers connected to it are counted
+    # (without a sender, has_listeners() counts only the sender-less receivers)
+    return treenode_event.has_listeners(model) or _get_events_handler() is not None
+
+
+def send_event(name, model=None, **data):
+    """
+    Sends the event to the settings.TREENODE_EVENTS_HANDLER callable
+    (called with name, model and data arguments) and to the treenode_event
+    signal receivers, errors raised by them are logged and never propagated.
+    """
+    handler = _get_events_handler()
+    if handler is not None:
+        try:
+            handler(name, model, data)
+        except Exception:
+            logger.exception(f"Error handling treenode event {name!r}.")
+    responses = treenode_event.send_robust(sender=model, name=name, data=data)
+    for _, response in responses:
+        if isinstance(response, Exception):
+            logger.error(
+                f"Error handling treenode event {name!r}: {response!r}",
+                exc_info=response,
+            )
+
+
+def get_size(value):
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class count_queries:
+    """
+    Counts the queries executed in the current thread using
+    connection.execute_wrapper, so it works also with settings.DEBUG = False.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.__stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.__stack = ExitStack()
+        for connection in connections.all():
+            self.__stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.__stack.close()
+
+
+class instrument_rebuild:
+    """
+    Sends "rebuild_started" and "rebuild_finished" (or "rebuild_failed") events
+    for the given model, the dict returned entering the context can be used
+    to add data to the "rebuild_finished" event.
+    Does nothing if there are no events handler and no signal receivers.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.__model = model
+        self.__enabled = False
+        self.__data = {}
+
+    def __enter__(self):
+        self.__enabled = is_instrumentation_enabled(self.__model)
+        if not self.__enabled:
+            return self.__data
+        send_event("rebuild_started", self.__model)
+        self.__queries = count_queries().__enter__()
+        self.__timer = timeit.default_timer()
+        return self.__data
+
+    def __exit__(self, type_, value, traceback):
+        if not self.__enabled:
+            return
+        duration = timeit.default_timer() - self.__timer
+        self.__queries.__exit__(type_, value, traceback)
+        data = dict(self.__data)
+        data.update({"queries": self.__queries.count, "duration": duration})
+        if value is not None:
+            send_event("rebuild_failed", self.__model, error=value, **data)
+        else:
+            send_event("rebuild_finished", self.__model, **data)
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from treenode.rebuild import get_treenode_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the tree fields of the given TreeNodeModel models (all if omitted) "
+        "without writing them, optionally repairing only the mismatching rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            metavar="app_label.ModelName",
+            help="The models to check, all TreeNodeModel models if omitted.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="The number of rows read from the database at once.",
+        )
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=10,
+            help="The max number of mismatching pks reported for each field.",
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Update only the mismatching rows.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="The database alias of the trees (default: router.db_for_write).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            models = get_treenode_models(options["models"])
+        except ValueError as error:
+            raise CommandError(error) from error
+        repair = options["repair"]
+        errors_count = 0
+        circular_refs_count = 0
+        for model in models:
+            label = model._meta.label
+            report = model.check_tree(
+                repair=repair,
+                chunk_size=options["chunk_size"],
+                samples=options["samples"],
+                using=options["database"],
+            )
+            if not report:
+                self.stdout.write(f"{label}: OK")
+                continue
+            errors_count += 1
+            if "circular_refs" in report:
+                circular_refs_count += 1
+            status = "repaired" if repair else "mismatching"
+            self.stdout.write(f"{label}: {len(report)} fields {status}")
+            for field, field_report in report.items():
+                field_count = field_report["count"]
+                field_pks = ", ".join(field_report["pks"])
+                self.stdout.write(f"  {field}: {field_count} rows (pks: {field_pks})")
+        if errors_count and not repair:
+            raise CommandError(
+                f"{errors_count} trees with mismatching fields, "
+                "run with --repair to update the mismatching rows."
+            )
+        if circular_refs_count:
+            raise CommandError(
+                f"{circular_refs_count} trees with circular references, "
+                "the tn_parent of the reported rows must be fixed manually."
+            )
@@ -0,0 +1,71 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from treenode.rebuild import get_treenode_models, update_trees
+
+
+class Command(BaseCommand):
+    help = "Rebuild the tree of the given TreeNodeModel models (all if omitted)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            metavar="app_label.ModelName",
+            help="The models to rebuild, all TreeNodeModel models if omitted.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="The number of models rebuilt in parallel (default: all).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Show the rows and fields that would change without writing them.",
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help="The database alias of the trees (default: router.db_for_write).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            models = get_treenode_models(options["models"])
+        except ValueError as error:
+            raise CommandError(error) from error
+        dry_run = options["dry_run"]
+        verbosity = options["verbosity"]
+        results = update_trees(
+            models,
+            workers=options["workers"],
+            dry_run=dry_run,
+            using=options["database"],
+        )
+        for stats in results:
+            label = stats.model._meta.label
+            fields_counter = Counter(
+                field for obj_data in stats.changes.values() for field in obj_data
+            )
+            rows_count = stats.rows_changed
+            fields_count = stats.fields_changed
+            duration = stats.duration
+            if dry_run:
+                message = (
+                    f"{label}: {rows_count} rows and {fields_count} fields "
+                    f"would change (computed in {duration:.3f}s)."
+                )
+            else:
+                message = (
+                    f"{label}: {rows_count} rows and {fields_count} fields "
+                    f"changed (rebuilt in {duration:.3f}s)."
+                )
+            self.stdout.write(message)
+            if verbosity >= 2:
+                for field, count in sorted(fields_counter.items()):
+                    self.stdout.write(f"  {field}: {count}")
+                for phase, timer in stats.phases.items():
+                    self.stdout.write(f"  {phase}: {timer:.3f}s")
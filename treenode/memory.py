@@ -1,7 +1,37 @@
 import weakref
 from collections import defaultdict
+from contextvars import ContextVar
 
-__refs__ = defaultdict(weakref.WeakSet)
+from django.db import router
+
+# live instances weak references indexed by model and pk,
+# {cls: {pk: {id(obj): ref}}} (instances with the same pk are equal),
+# so that updating the instances of the changed nodes doesn't require
+# to iterate over all the live instances of the model
+__refs__ = defaultdict(dict)
+__refs_enabled__ = ContextVar("treenode_refs_enabled", default=True)
+
+
+def __remove_ref(cls_refs, key, ref_id, ref):
+    obj_refs = cls_refs.get(key)
+    if obj_refs is None or obj_refs.get(ref_id) is not ref:
+        return
+    obj_refs.pop(ref_id, None)
+    if not obj_refs:
+        cls_refs.pop(key, None)
+
+
+def __get_objs(obj_refs):
+    objs = (ref() for ref in list(obj_refs.values()))
+    return [obj for obj in objs if obj is not None]
+
+
+def __is_ref_using(cls, obj, using):
+    # instances read from a replica belong to the tree of the database for write,
+    # instances of trees of other databases (with the same pk) are skipped
+    if not using or obj._state.db in (None, using):
+        return True
+    return router.db_for_write(cls, instance=obj) == using
 
 
 def clear_refs(cls):
@@ -9,18 +39,61 @@ def clear_refs(cls):
 
 
 def get_refs(cls):
-    return __refs__[cls]
+    objs = []
+    for obj_refs in list(__refs__[cls].values()):
+        objs += __get_objs(obj_refs)
+    return objs
+
+
+def get_refs_count(cls=None):
+    """
+    Returns the number of live instances referenced by the registry
+    for the given model (for all models if omitted).
+    """
+    models = [cls] if cls else list(__refs__.keys())
+    return sum(
+        len(obj_refs) for model in models for obj_refs in list(__refs__[model].values())
+    )
+
+
+def is_ref_enabled(cls):
+    return cls.treenode_track_instances and __refs_enabled__.get()
 
 
 def set_ref(cls, obj):
-    if obj.pk:
-        __refs__[cls].add(obj)
+    if not obj.pk or not is_ref_enabled(cls):
+        return
+    cls_refs = __refs__[cls]
+    key = str(obj.pk)
+    ref_id = id(obj)
+    obj_refs = cls_refs.setdefault(key, {})
+    obj_refs[ref_id] = weakref.ref(
+        obj, lambda ref: __remove_ref(cls_refs, key, ref_id, ref)
+    )
 
 
-def update_refs(cls, data):
-    for obj in get_refs(cls):
-        obj_key = str(obj.pk)
-        obj_data = data.get(obj_key)
-        if obj_data:
+def update_refs(cls, data, using=None):
+    cls_refs = __refs__[cls]
+    for obj_key, obj_data in data.items():
+        obj_refs = cls_refs.get(obj_key)
+        if not obj_refs or not obj_data:
+            continue
+        for obj in __get_objs(obj_refs):
+            if not __is_ref_using(cls, obj, using):
+                continue
             for key, value in obj_data.items():
                 setattr(obj, key, value)
+
+
+class no_refs:
+    """
+    Disables the tracking of the instances loaded in the current context
+    (thread or task), they will not be updated by the tree updates.
+    """
+
+    def __enter__(self):
+        self.__token = __refs_enabled__.set(False)
+        return None
+
+    def __exit__(self, type_, value, traceback):
+        __refs_enabled__.reset(self.__token)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("treenode", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="treenodeversion",
+            name="checksum",
+            field=models.CharField(
+                blank=True, default="", max_length=64, verbose_name="Checksum"
+            ),
+        ),
+    ]
@@ -1,20 +1,50 @@
+import hashlib
+import json
+import logging
+import timeit
 import uuid
+from collections import deque
 
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models, router, transaction
+from django.db import DatabaseError, connections, models, router, transaction
 from django.db.models import F, Q
+from django.utils import timezone
 from django.utils.encoding import force_str
 from django.utils.html import conditional_escape
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
 from treenode import classproperty
-from treenode.cache import clear_cache, query_cache, update_cache
-from treenode.debug import debug_performance
+from treenode.cache import (
+    aget_cached_tree_json,
+    aget_cached_version,
+    aquery_cache,
+    aset_cached_tree_json,
+    aset_cached_version,
+    clear_cache,
+    delete_cached_dirty,
+    delete_cached_tree_json,
+    get_cached_dirty,
+    get_cached_tree_json,
+    get_cached_version,
+    query_cache,
+    set_cached_dirty,
+    set_cached_tree_json,
+    set_cached_version,
+    update_cache,
+)
+from treenode.debug import TreeUpdateStats, debug_performance, profile_performance
 from treenode.exceptions import CacheError, CircularReferenceError
-from treenode.memory import clear_refs, update_refs
+from treenode.instrumentation import instrument_rebuild
+from treenode.memory import clear_refs, no_refs, set_ref, update_refs
+from treenode.rebuild import schedule_tree_update
 from treenode.signals import connect_signals, no_signals
-from treenode.utils import contains_pk, join_pks, split_pks
+from treenode.utils import contains_pk, join_pks, parse_pks
+
+logger = logging.getLogger(__name__)
 
 
 class TreeNodeModel(models.Model):
@@ -38,6 +68,28 @@ class TreeNodeModel(models.Model):
 
     # Options
     treenode_display_field = None
+    # keep tree fields of loaded instances updated after each tree update
+    treenode_track_instances = True
+    # split the nodes in independent trees (eg. one per tenant) by this field value
+    treenode_scope_field = None
+    # encoding of the tn_*_pks fields, "text" (comma separated) or "compact"
+    treenode_pks_encoding = "text"
+
+    # the tree fields computed by the tree update
+    __tree_fields = (
+        "tn_ancestors_count",
+        "tn_ancestors_pks",
+        "tn_children_count",
+        "tn_children_pks",
+        "tn_depth",
+        "tn_descendants_count",
+        "tn_descendants_pks",
+        "tn_index",
+        "tn_level",
+        "tn_order",
+        "tn_siblings_count",
+        "tn_siblings_pks",
+    )
 
     # Fields
     # All fields are for internal usage and they are prefixed by 'tn_'
@@ -138,94 +190,295 @@ class TreeNodeModel(models.Model):
 
     # Public methods
 
+    @classmethod
+    def bulk_create_tree(cls, data, parent=None, batch_size=None, using=None):
+        """
+        Creates the nodes of the given data under the given parent (as roots
+        by default), each level of nodes is inserted using bulk_create,
+        then the tree is updated once (its changed rows are written one by one).
+        Data is a list of nodes, each node can be an unsaved instance,
+        an (instance, children) tuple or a dict of field values with an optional
+        "children" key. Raises ValueError if a node belongs to another scope
+        of its parent. Returns the list of the created nodes (in the data order).
+        """
+        if parent is not None and not parent.pk:
+            raise ValueError("parent must be saved before creating its children.")
+        if using is None:
+            using = parent._state.db if parent else router.db_for_write(cls)
+        objs, levels = cls.__get_bulk_nodes(data, parent)
+        for level_nodes in levels:
+            for obj, obj_parent in level_nodes:
+                if obj_parent and obj._get_scope() != obj_parent._get_scope():
+                    raise ValueError(
+                        "obj can't be created, it belongs to another scope of parent."
+                    )
+        can_bulk_insert = connections[using].features.can_return_rows_from_bulk_insert
+        objs_manager = cls.objects.using(using)
+        with no_signals():
+            with transaction.atomic(using=using):
+                for level, level_nodes in enumerate(levels):
+                    level_objs = []
+                    for obj, obj_parent in level_nodes:
+                        # parents have been inserted with the previous level
+                        obj.tn_parent = obj_parent
+                        level_objs.append(obj)
+                    if can_bulk_insert or level == len(levels) - 1:
+                        objs_manager.bulk_create(level_objs, batch_size=batch_size)
+                    else:
+                        # pks are needed to insert the next level
+                        for obj in level_objs:
+                            obj.save(using=using)
+        # keep the created instances updated by the tree update
+        for obj in objs:
+            set_ref(cls, obj)
+        scopes = {obj._get_scope() for obj in objs}
+        scope = scopes.pop() if len(scopes) == 1 else None
+        schedule_tree_update(cls, using=using, scope=scope)
+        return objs
+
+    def copy_subtree(
+        self, parent=None, field_overrides=None, cache=True, batch_size=None, using=None
+    ):
+        """
+        Copies the node and its descendants under the given parent (as root
+        by default) using bulk_create_tree, the tree is updated only once.
+        field_overrides is a dict of field values set to all the copies,
+        values can be callables receiving the original node (eg. for unique fields).
+        The copy is created in the database of the node by default.
+        Raises ValueError if the copy belongs to another scope of parent.
+        Returns the copy of the node.
+        """
+        using = self.__get_db_for_write(using or self._state.db)
+        objs = [self] + self.get_descendants(cache=cache, using=using)
+        overrides = {
+            self._meta.get_field(key): value
+            for key, value in (field_overrides or {}).items()
+        }
+        # tree fields are computed by the tree update, the priority is kept
+        fields = [
+            field
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and (not field.name.startswith("tn_") or field.name == "tn_priority")
+        ]
+        nodes = {}
+        data = []
+        # descendants are ordered, so parents are visited before their children
+        for obj in objs:
+            values = {field.attname: getattr(obj, field.attname) for field in fields}
+            for field, value in overrides.items():
+                value = value(obj) if callable(value) else value
+                if field.is_relation and isinstance(value, models.Model):
+                    value = getattr(value, field.target_field.attname)
+                values[field.attname] = value
+            node = (self.__class__(**values), [])
+            nodes[str(obj.pk)] = node
+            if obj is self:
+                data.append(node)
+            else:
+                nodes[str(obj.tn_parent_id)][1].append(node)
+        if parent and data[0][0]._get_scope() != parent._get_scope():
+            raise ValueError(
+                "obj can't be copied, it belongs to another scope of parent."
+            )
+        objs_copies = self.__class__.bulk_create_tree(
+            data, parent=parent, batch_size=batch_size, using=using
+        )
+        return objs_copies[0]
+
+    def clean(self):
+        super().clean()
+        if not self.__has_parent_in_scope():
+            raise ValidationError(
+                {"tn_parent": _("The parent must belong to the same scope.")}
+            )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if cls.treenode_scope_field:
+            instance.__set_saved_scope()
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self.__has_parent_in_scope():
+            raise ValueError("obj parent belongs to another scope.")
+        if self.tn_children_count and self._get_saved_scope() != self._get_scope():
+            raise ValueError("obj with children can't be moved to another scope.")
+        super().save(*args, **kwargs)
+        if self.treenode_scope_field:
+            self.__set_saved_scope()
+
+    def __set_saved_scope(self):
+        # the scope stored in the database, its tree is updated too
+        # when the node is saved with another scope
+        attname = self._meta.get_field(self.treenode_scope_field).attname
+        if attname in self.__dict__:
+            self.__dict__["_treenode_saved_scope"] = self.__dict__[attname]
+
+    def _get_saved_scope(self):
+        return self.__dict__.get("_treenode_saved_scope", self._get_scope())
+
     def delete(self, using=None, keep_parents=False, cascade=True):
+        using = self.__get_db_for_write(using)
         with no_signals():
             if not cascade:
-                children_qs = self.get_children_queryset()
+                children_qs = self.get_children_queryset(using=using)
                 children_qs.update(tn_parent=None)
-            self.__class__.objects.filter(pk=self.pk).delete()
-        self.update_tree()
+            self.__class__.objects.using(using).filter(pk=self.pk).delete()
+        schedule_tree_update(self.__class__, using=using, scope=self._get_scope())
 
     @classmethod
-    def delete_tree(cls):
+    def delete_tree(cls, using=None):
+        using = using or router.db_for_write(cls)
+        prev_version = get_cached_version(cls, using=using)
         with no_signals():
-            with transaction.atomic(using=router.db_for_write(cls)):
-                cls.objects.all().delete()
+            with transaction.atomic(using=using):
+                cls.objects.using(using).all().delete()
+                # the tree changed without a tree update, bump its version anyway
+                tree_version = cls.__update_tree_version(
+                    using=using, checksum=cls.__get_tree_checksum_from_rows([])
+                )
             clear_refs(cls)
-            clear_cache(cls)
+            clear_cache(cls, using=using)
+        if tree_version:
+            cls.__update_tree_version_cache(tree_version, using=using)
+        if prev_version is not None:
+            # the rows are gone, the serialized tree must not be served anymore
+            delete_cached_tree_json(cls, prev_version[0], using=using)
+
+    @classmethod
+    def _filter_scope(cls, queryset, scope=None):
+        if scope is None or not cls.treenode_scope_field:
+            return queryset
+        return queryset.filter(**{cls.treenode_scope_field: scope})
 
     @classmethod
-    def _get_all(cls, cache=True):
+    def _get_all(cls, cache=True, using=None, scope=None):
         if cache:
             try:
-                return query_cache(cls)
+                return query_cache(cls, using=using, scope=scope)
             except CacheError:
                 pass
-        return list(cls.objects.all())
+        return list(cls._filter_scope(cls.objects.using(using).all(), scope))
+
+    def __has_parent_in_scope(self):
+        if not self.treenode_scope_field or self.tn_parent_id is None:
+            return True
+        return self.tn_parent._get_scope() == self._get_scope()
 
-    def get_ancestors(self, cache=True):
+    def _get_scope(self):
+        field_name = self.treenode_scope_field
+        if not field_name:
+            return None
+        return getattr(self, self._meta.get_field(field_name).attname)
+
+    def get_ancestors(self, cache=True, using=None):
         if cache:
             try:
-                return query_cache(self.__class__, pks=self.tn_ancestors_pks)
+                return query_cache(
+                    self.__class__,
+                    pks=self.get_ancestors_pks(),
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
             except CacheError:
                 pass
-        return list(self.get_ancestors_queryset())
+        return list(self.get_ancestors_queryset(using=using))
 
     def get_ancestors_count(self):
         return self.tn_ancestors_count
 
     def get_ancestors_pks(self):
-        return split_pks(self.tn_ancestors_pks)
+        return self.__get_pks("tn_ancestors_pks")
 
-    def get_ancestors_queryset(self):
-        return self.__class__.objects.filter(pk__in=self.get_ancestors_pks())
+    def get_ancestors_queryset(self, using=None):
+        return self.__get_queryset(using).filter(pk__in=self.get_ancestors_pks())
 
-    def get_breadcrumbs(self, attr=None, cache=True):
-        objs = (self.get_ancestors(cache=cache) if self.tn_parent_id else []) + [self]
+    def get_breadcrumbs(self, attr=None, cache=True, using=None):
+        objs = self.get_ancestors(cache=cache, using=using) if self.tn_parent_id else []
+        objs = objs + [self]
         return [getattr(obj, attr) for obj in objs] if attr else objs
 
-    def get_children(self, cache=True):
+    def get_children(self, cache=True, using=None):
         if cache:
             try:
-                return query_cache(self.__class__, pks=self.tn_children_pks)
+                return query_cache(
+                    self.__class__,
+                    pks=self.get_children_pks(),
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
             except CacheError:
                 pass
-        return list(self.get_children_queryset())
+        return list(self.get_children_queryset(using=using))
 
     def get_children_count(self):
         return self.tn_children_count
 
     def get_children_pks(self):
-        return split_pks(self.tn_children_pks)
+        return self.__get_pks("tn_children_pks")
 
-    def get_children_queryset(self):
-        return self.__class__.objects.filter(pk__in=self.get_children_pks())
+    def get_children_queryset(self, using=None):
+        return self.__get_queryset(using).filter(pk__in=self.get_children_pks())
+
+    @classmethod
+    def get_common_ancestor(cls, *objs, cache=True, using=None):
+        """
+        Gets the lowest common ancestor of the given nodes (a node is considered
+        ancestor of itself), None if they belong to different trees.
+        """
+        if not objs:
+            raise ValueError("At least one node is required.")
+        lineages = [obj.__get_lineage_pks() for obj in objs]
+        common_len = cls.__get_common_lineage_len(lineages)
+        if not common_len:
+            return None
+        common_pk = lineages[0][common_len - 1]
+        return cls.__get_nodes_by_pks(objs[0], [common_pk], cache, using)[0]
 
     def get_depth(self):
         return self.tn_depth
 
-    def get_descendants(self, cache=True):
+    @classmethod
+    def get_distance(cls, obj, other_obj):
+        """
+        Gets the number of edges of the path between the given nodes,
+        None if they belong to different trees.
+        """
+        lineages = [obj.__get_lineage_pks(), other_obj.__get_lineage_pks()]
+        common_len = cls.__get_common_lineage_len(lineages)
+        if not common_len:
+            return None
+        return len(lineages[0]) + len(lineages[1]) - (2 * common_len)
+
+    def get_descendants(self, cache=True, using=None):
         if cache:
             try:
-                return query_cache(self.__class__, pks=self.tn_descendants_pks)
+                return query_cache(
+                    self.__class__,
+                    pks=self.get_descendants_pks(),
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
             except CacheError:
                 pass
-        return list(self.get_descendants_queryset())
+        return list(self.get_descendants_queryset(using=using))
 
     def get_descendants_count(self):
         return self.tn_descendants_count
 
     def get_descendants_pks(self):
-        return split_pks(self.tn_descendants_pks)
+        return self.__get_pks("tn_descendants_pks")
 
-    def get_descendants_queryset(self):
-        return self.__class__.objects.filter(pk__in=self.get_descendants_pks())
+    def get_descendants_queryset(self, using=None):
+        return self.__get_queryset(using).filter(pk__in=self.get_descendants_pks())
 
-    def get_descendants_tree(self, cache=True):
-        return self.__get_nodes_tree(instance=self, cache=cache)
+    def get_descendants_tree(self, cache=True, using=None):
+        return self.__get_nodes_tree(instance=self, cache=cache, using=using)
 
-    def get_descendants_tree_display(self, cache=True):
-        objs = self.get_descendants(cache=cache)
+    def get_descendants_tree_display(self, cache=True, using=None):
+        objs = self.get_descendants(cache=cache, using=using)
         strs = [f"{obj}" for obj in objs]
         d = "\n".join(strs)
         return d
@@ -239,6 +492,11 @@ class TreeNodeModel(models.Model):
     #         default=func if not default else default)
     #     return dump
 
+    def get_descendants_tree_json(self, cache=True, using=None):
+        return self.__get_nodes_tree_json(
+            instance=self, cache=cache, using=self.__get_db_for_write(using)
+        )
+
     def get_display(self, indent=True, mark="— "):
         indentation = (mark * self.tn_ancestors_count) if indent else ""
         indentation = force_str(indentation)
@@ -264,14 +522,18 @@ class TreeNodeModel(models.Model):
             text = self.pk
         return force_str(text)
 
-    def get_first_child(self, cache=True):
-        return self.get_children(cache=cache)[0] if self.get_children_count() else None
+    def get_first_child(self, cache=True, using=None):
+        if not self.get_children_count():
+            return None
+        return self.get_children(cache=cache, using=using)[0]
 
     def get_index(self):
         return self.tn_index
 
-    def get_last_child(self, cache=True):
-        return self.get_children(cache=cache)[-1] if self.get_children_count() else None
+    def get_last_child(self, cache=True, using=None):
+        if not self.get_children_count():
+            return None
+        return self.get_children(cache=cache, using=using)[-1]
 
     def get_level(self):
         return self.tn_level
@@ -285,6 +547,20 @@ class TreeNodeModel(models.Model):
     def get_parent_pk(self):
         return self.tn_parent_id
 
+    @classmethod
+    def get_path(cls, obj, other_obj, cache=True, using=None):
+        """
+        Gets the list of the nodes of the path from obj to other_obj (both included)
+        through their lowest common ancestor, None if they belong to different trees.
+        """
+        lineages = [obj.__get_lineage_pks(), other_obj.__get_lineage_pks()]
+        common_len = cls.__get_common_lineage_len(lineages)
+        if not common_len:
+            return None
+        up_pks = lineages[0][common_len - 1 :][::-1]
+        down_pks = lineages[1][common_len:]
+        return cls.__get_nodes_by_pks(obj, [*up_pks, *down_pks], cache, using)
+
     def set_parent(self, obj):
         with no_signals():
             if obj:
@@ -298,14 +574,20 @@ class TreeNodeModel(models.Model):
                     )
                 if obj == self:
                     raise ValueError("obj can't be set as parent of itself.")
+                if obj._get_scope() != self._get_scope():
+                    raise ValueError(
+                        "obj can't be set as parent, it belongs to another scope."
+                    )
                 if not obj.pk:
                     obj.save()
-                if contains_pk(self.tn_descendants_pks, obj.pk):
+                if obj.is_descendant_of(self):
                     obj.tn_parent = self.tn_parent
                     obj.save()
             self.tn_parent = obj
             self.save()
-        self.update_tree()
+        schedule_tree_update(
+            self.__class__, using=self._state.db, scope=self._get_scope()
+        )
 
     def get_priority(self):
         return self.tn_priority
@@ -314,55 +596,104 @@ class TreeNodeModel(models.Model):
         self.tn_priority = val
         self.save()
 
-    def get_root(self, cache=True):
+    def get_root(self, cache=True, using=None):
         root_pk = self.get_root_pk()
         if cache:
             try:
-                return query_cache(self.__class__, pk=root_pk)
+                return query_cache(
+                    self.__class__,
+                    pk=root_pk,
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
             except CacheError:
                 pass
-        return self.__class__.objects.get(pk=root_pk)
+        return self.__get_queryset(using).get(pk=root_pk)
 
     def get_root_pk(self):
-        return (split_pks(self.tn_ancestors_pks) + [self.pk])[0]
+        ancestors_pks = self.get_ancestors_pks()
+        return ancestors_pks[0] if ancestors_pks else self.pk
 
     @classmethod
-    def get_roots(cls, cache=True):
+    def get_roots(cls, cache=True, using=None, scope=None):
         if cache:
             try:
-                return [obj for obj in query_cache(cls) if obj.tn_ancestors_count == 0]
+                objs = query_cache(cls, using=using, scope=scope)
+                return [obj for obj in objs if obj.tn_ancestors_count == 0]
             except CacheError:
                 pass
-        return list(cls.get_roots_queryset())
+        return list(cls.get_roots_queryset(using=using, scope=scope))
 
     @classmethod
-    def get_roots_queryset(cls):
-        return cls.objects.filter(tn_ancestors_count=0)
+    def get_roots_queryset(cls, using=None, scope=None):
+        objs_qs = cls.objects.using(using).filter(tn_ancestors_count=0)
+        return cls._filter_scope(objs_qs, scope)
 
-    def get_siblings(self, cache=True):
+    def get_siblings(self, cache=True, using=None):
         if cache:
             try:
-                return query_cache(self.__class__, pks=self.tn_siblings_pks)
+                return query_cache(
+                    self.__class__,
+                    pks=self.get_siblings_pks(),
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
             except CacheError:
                 pass
-        return list(self.get_siblings_queryset())
+        return list(self.get_siblings_queryset(using=using))
 
     def get_siblings_count(self):
         return self.tn_siblings_count
 
     def get_siblings_pks(self):
-        return split_pks(self.tn_siblings_pks)
+        return self.__get_pks("tn_siblings_pks")
 
-    def get_siblings_queryset(self):
-        return self.__class__.objects.filter(pk__in=self.get_siblings_pks())
+    def get_siblings_queryset(self, using=None):
+        return self.__get_queryset(using).filter(pk__in=self.get_siblings_pks())
 
     @classmethod
-    def get_tree(cls, cache=True):
-        return cls.__get_nodes_tree(instance=None, cache=cache)
+    def get_tree(cls, cache=True, using=None, scope=None):
+        return cls.__get_nodes_tree(
+            instance=None, cache=cache, using=using, scope=scope
+        )
 
     @classmethod
-    def get_tree_display(cls, cache=True):
-        objs = cls._get_all(cache=cache)
+    def get_tree_json(cls, cache=True, using=None, scope=None):
+        return cls.__get_nodes_tree_json(
+            instance=None, cache=cache, using=using, scope=scope
+        )
+
+    def get_tree_json_data(self):
+        """
+        Gets the data that will be serialized for each node by `get_tree_json`
+        and `get_descendants_tree_json` methods.
+        Override this method to serialize other fields or computed values.
+        """
+        return {"pk": self.pk, "display": self.get_display_text()}
+
+    @classmethod
+    def get_tree_last_modified(cls, using=None):
+        return cls.__get_tree_version(using=using)[1]
+
+    @classmethod
+    def get_tree_version(cls, using=None):
+        return cls.__get_tree_version(using=using)[0]
+
+    @classmethod
+    def get_tree_checksum(cls, using=None):
+        """
+        Gets the checksum of the tree data (parents, priorities, display field
+        and computed tree fields) read from the database, it is stored
+        on every tree update and compared after migrations to skip the update
+        of trees that didn't change.
+        """
+        fields = cls.__get_tree_checksum_fields()
+        rows = cls.objects.using(using).values_list(*fields)
+        return cls.__get_tree_checksum_from_rows(rows)
+
+    @classmethod
+    def get_tree_display(cls, cache=True, using=None, scope=None):
+        objs = cls._get_all(cache=cache, using=using, scope=scope)
         strs = [f"{obj}" for obj in objs]
         d = "\n".join(strs)
         return d
@@ -382,7 +713,9 @@ class TreeNodeModel(models.Model):
             self.__class__ == obj.__class__
             and self.pk
             and self.pk != obj.pk
-            and contains_pk(obj.tn_ancestors_pks, self.pk)
+            and contains_pk(
+                obj.tn_ancestors_pks, self.pk, encoding=self.treenode_pks_encoding
+            )
         )
 
     def is_child_of(self, obj):
@@ -390,15 +723,19 @@ class TreeNodeModel(models.Model):
             self.__class__ == obj.__class__
             and self.pk
             and self.pk != obj.pk
-            and contains_pk(obj.tn_children_pks, self.pk)
+            and self.tn_parent_id is not None
+            and str(obj.pk) == str(self.tn_parent_id)
         )
 
     def is_descendant_of(self, obj):
+        # the ancestors pks are much shorter than the descendants pks
         return (
             self.__class__ == obj.__class__
             and self.pk
             and self.pk != obj.pk
-            and contains_pk(obj.tn_descendants_pks, self.pk)
+            and contains_pk(
+                self.tn_ancestors_pks, obj.pk, encoding=self.treenode_pks_encoding
+            )
         )
 
     def is_first_child(self):
@@ -415,8 +752,8 @@ class TreeNodeModel(models.Model):
             self.__class__ == obj.__class__
             and self.pk
             and self.pk != obj.pk
-            and obj.tn_ancestors_count > 0
-            and str(self.pk) == split_pks(obj.tn_ancestors_pks)[-1]
+            and obj.tn_parent_id is not None
+            and str(self.pk) == str(obj.tn_parent_id)
         )
 
     def is_root(self):
@@ -434,80 +771,600 @@ class TreeNodeModel(models.Model):
         )
 
     @classmethod
-    def update_tree(cls):
+    def is_tree_dirty(cls, using=None, scope=None):
+        """
+        Returns True if the tree (of the given scope) has changes not applied yet
+        by a background tree update (settings.TREENODE_UPDATE_MODE),
+        without scope it returns True if any of the scopes has changes.
+        """
+        return get_cached_dirty(cls, using=using, scope=scope)
+
+    @classmethod
+    def move_nodes(cls, objs, parent=None, priority=None, using=None):
+        """
+        Moves the given nodes under the given parent (to roots by default)
+        using a single update query and updates the tree only once,
+        if priority is specified it is set to all the moved nodes
+        (the position of a node among its siblings depends on its priority).
+        Raises ValueError if parent is one of the nodes or one of their descendants.
+        """
+        objs = list(objs)
+        if not objs:
+            return
+        for obj in [*objs, parent]:
+            if obj is None:
+                continue
+            if obj.__class__ != cls:
+                raise ValueError(
+                    f"obj can't be moved, it is instance of {obj.__class__.__name__}, "
+                    f"expected instance of {cls.__name__}."
+                )
+            if not obj.pk:
+                raise ValueError("obj can't be moved, it must be saved first.")
+        objs_keys = {str(obj.pk) for obj in objs}
+        if parent is not None:
+            # the parent (or one of its ancestors) can't be one of the moved nodes
+            parent_lineage = parent.__get_lineage_pks()
+            if any(str(pk) in objs_keys for pk in parent_lineage):
+                raise ValueError(
+                    "obj can't be moved, parent is one of the moved nodes "
+                    "or one of their descendants."
+                )
+            if any(obj._get_scope() != parent._get_scope() for obj in objs):
+                raise ValueError(
+                    "obj can't be moved, it belongs to another scope of parent."
+                )
+        using = objs[0].__get_db_for_write(using)
+        values = {"tn_parent": parent}
+        if priority is not None:
+            values["tn_priority"] = priority
+        # queryset updates don't send signals
+        objs_qs = cls.objects.using(using).filter(pk__in=[obj.pk for obj in objs])
+        objs_qs.update(**values)
+        for obj in objs:
+            for key, value in values.items():
+                setattr(obj, key, value)
+        scopes = {obj._get_scope() for obj in objs}
+        scope = scopes.pop() if len(scopes) == 1 else None
+        schedule_tree_update(cls, using=using, scope=scope)
+
+    @classmethod
+    def walk_tree(cls, order="pre", cache=True, using=None, scope=None):
+        cls.__validate_walk_order(order)
+        objs_list = cls._get_all(cache=cache, using=using, scope=scope)
+        return cls.__walk_objs(objs_list, order=order)
+
+    def walk_descendants(self, order="pre", cache=True, using=None):
+        self.__validate_walk_order(order)
+        objs_list = self.get_descendants(cache=cache, using=using)
+        return self.__walk_objs(objs_list, instance=self, order=order)
+
+    @classmethod
+    def check_tree(
+        cls, repair=False, chunk_size=2000, samples=10, using=None, scope=None
+    ):
+        """
+        Verifies the tree fields of all nodes without writing anything,
+        the table is read in chunks of chunk_size rows (without loading
+        model instances unless the display text is customized).
+        Returns a dict with the mismatching rows count and a list of sample pks
+        for each mismatching field, eg. {"tn_order": {"count": 3, "pks": [...]}},
+        nodes that are ancestors of themselves are reported as "circular_refs".
+        With repair=True only the mismatching rows are updated
+        (except the ones with circular references).
+        """
+        using = using or router.db_for_write(cls)
+        stats = TreeUpdateStats(cls)
+        circular_pks = []
+        objs_data = cls.__get_nodes_data(
+            chunk_size=chunk_size,
+            stats=stats,
+            using=using,
+            scope=scope,
+            checksum=repair,
+            circular_pks=circular_pks,
+        )
+        report = {}
+        if circular_pks:
+            report["circular_refs"] = {
+                "count": len(circular_pks),
+                "pks": circular_pks[:samples],
+            }
+            # their tree fields can't be computed
+            for obj_pk in circular_pks:
+                objs_data.pop(obj_pk, None)
+        for obj_pk, obj_data in objs_data.items():
+            for field in obj_data:
+                field_report = report.setdefault(field, {"count": 0, "pks": []})
+                field_report["count"] += 1
+                if len(field_report["pks"]) < samples:
+                    field_report["pks"].append(obj_pk)
+        if repair and objs_data:
+            cls.__update_nodes_data(objs_data, stats=stats, using=using, scope=scope)
+        return dict(sorted(report.items()))
+
+    @classmethod
+    def update_tree(cls, dry_run=False, using=None, scope=None):
+        """
+        Updates the tree fields of all nodes, the in-memory instances and the cache.
+        Returns a TreeUpdateStats object with the changed fields values of each
+        changed node (stats.changes), the nodes count and the duration of each phase,
+        with dry_run=True the changes are computed without writing anything.
+        The tree is read and written in the given database alias
+        (router.db_for_write by default), if the model has a treenode_scope_field
+        only the nodes of the given scope are updated (all scopes by default).
+        """
+        using = using or router.db_for_write(cls)
         debug_message_prefix = (
             f"[treenode] update {cls.__module__}.{cls.__name__} tree: "
         )
 
-        with debug_performance(debug_message_prefix):
-            # update db
-            objs_data = cls.__get_nodes_data()
+        stats = TreeUpdateStats(cls, dry_run=dry_run)
+        with (
+            debug_performance(debug_message_prefix, stats=stats),
+            profile_performance(cls._meta.label_lower, stats=stats),
+            instrument_rebuild(cls) as event_data,
+        ):
+            timer = timeit.default_timer()
+            if not dry_run:
+                # changes made from now on will mark the tree dirty again
+                delete_cached_dirty(cls, using=using, scope=scope)
+            try:
+                # update db
+                stats.changes = cls.__get_nodes_data(
+                    stats=stats, using=using, scope=scope
+                )
+                if not dry_run:
+                    cls.__update_nodes_data(
+                        stats.changes, stats=stats, using=using, scope=scope
+                    )
+            except Exception:
+                if not dry_run:
+                    # the tree has not been updated, keep it marked dirty
+                    set_cached_dirty(cls, using=using, scope=scope)
+                raise
+            stats.end_phase()
+            stats.duration = timeit.default_timer() - timer
+            event_data.update(stats.to_dict())
+        return stats
+
+    # Async methods
+    # Async counterparts of the cache-backed and queryset-backed methods,
+    # they use the async cache and ORM api and can be awaited in async views.
+
+    @classmethod
+    async def _aget_all(cls, cache=True, using=None, scope=None):
+        if cache:
+            try:
+                return await aquery_cache(cls, using=using, scope=scope)
+            except CacheError:
+                pass
+        objs_qs = cls._filter_scope(cls.objects.using(using).all(), scope)
+        return [obj async for obj in objs_qs]
+
+    async def aget_ancestors(self, cache=True, using=None):
+        return await self.__aget_nodes(
+            self.get_ancestors_pks(), cache=cache, using=using
+        )
+
+    async def aget_breadcrumbs(self, attr=None, cache=True, using=None):
+        objs = []
+        if self.tn_parent_id:
+            objs = await self.aget_ancestors(cache=cache, using=using)
+        objs = objs + [self]
+        return [getattr(obj, attr) for obj in objs] if attr else objs
+
+    async def aget_children(self, cache=True, using=None):
+        return await self.__aget_nodes(
+            self.get_children_pks(), cache=cache, using=using
+        )
+
+    async def aget_descendants(self, cache=True, using=None):
+        return await self.__aget_nodes(
+            self.get_descendants_pks(), cache=cache, using=using
+        )
+
+    async def aget_descendants_tree(self, cache=True, using=None):
+        objs_list = await self.aget_descendants(cache=cache, using=using)
+        return self.__build_nodes_tree(objs_list, instance=self)
+
+    async def aget_descendants_tree_json(self, cache=True, using=None):
+        return await self.__aget_nodes_tree_json(
+            instance=self, cache=cache, using=self.__get_db_for_write(using)
+        )
+
+    async def aget_first_child(self, cache=True, using=None):
+        if not self.get_children_count():
+            return None
+        return (await self.aget_children(cache=cache, using=using))[0]
+
+    async def aget_last_child(self, cache=True, using=None):
+        if not self.get_children_count():
+            return None
+        return (await self.aget_children(cache=cache, using=using))[-1]
 
-            with transaction.atomic(using=router.db_for_write(cls)):
-                obj_manager = cls.objects
-                for obj_pk, obj_data in objs_data.items():
-                    obj_manager.filter(pk=obj_pk).update(**obj_data)
+    async def aget_parent(self, cache=True, using=None):
+        if not self.tn_parent_id:
+            return None
+        return await self.__aget_node(self.tn_parent_id, cache=cache, using=using)
 
-            # update in-memory instances
-            update_refs(cls, objs_data)
+    async def aget_root(self, cache=True, using=None):
+        return await self.__aget_node(self.get_root_pk(), cache=cache, using=using)
 
-            # update cache instances
+    @classmethod
+    async def aget_roots(cls, cache=True, using=None, scope=None):
+        if cache:
             try:
-                update_cache(cls)
+                objs = await aquery_cache(cls, using=using, scope=scope)
+                return [obj for obj in objs if obj.tn_ancestors_count == 0]
             except CacheError:
                 pass
+        objs_qs = cls.get_roots_queryset(using=using, scope=scope)
+        return [obj async for obj in objs_qs]
+
+    async def aget_siblings(self, cache=True, using=None):
+        return await self.__aget_nodes(
+            self.get_siblings_pks(), cache=cache, using=using
+        )
+
+    @classmethod
+    async def aget_tree(cls, cache=True, using=None, scope=None):
+        objs_list = await cls._aget_all(cache=cache, using=using, scope=scope)
+        return cls.__build_nodes_tree(objs_list)
+
+    @classmethod
+    async def aget_tree_json(cls, cache=True, using=None, scope=None):
+        return await cls.__aget_nodes_tree_json(
+            instance=None, cache=cache, using=using, scope=scope
+        )
+
+    @classmethod
+    async def aupdate_tree(cls, dry_run=False, using=None, scope=None):
+        # the update runs in a transaction, that is not supported
+        # by the async ORM, so it is run in the sync thread
+        return await sync_to_async(cls.update_tree)(
+            dry_run=dry_run, using=using, scope=scope
+        )
 
     # Private methods
 
-    def __get_node_order_str(self):
+    async def __aget_node(self, pk, cache=True, using=None):
+        if cache:
+            try:
+                return await aquery_cache(
+                    self.__class__,
+                    pk=pk,
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
+            except CacheError:
+                pass
+        return await self.__get_queryset(using).aget(pk=pk)
+
+    async def __aget_nodes(self, pks, cache=True, using=None):
+        if cache:
+            try:
+                return await aquery_cache(
+                    self.__class__,
+                    pks=pks,
+                    using=self.__get_db_for_write(using),
+                    scope=self._get_scope(),
+                )
+            except CacheError:
+                pass
+        objs_qs = self.__get_queryset(using).filter(pk__in=pks)
+        return [obj async for obj in objs_qs]
+
+    def __get_pks(self, field_name):
+        # the pks are parsed once for each field value, the parsed value
+        # is replaced as soon as a new value is assigned (eg. by update_refs)
+        value = getattr(self, field_name)
+        pks_cache = self.__dict__.setdefault("_treenode_pks_cache", {})
+        cached_value, pks = pks_cache.get(field_name, (None, None))
+        if pks is None or cached_value is not value:
+            pks = parse_pks(
+                value, self._meta.pk.to_python, encoding=self.treenode_pks_encoding
+            )
+            pks_cache[field_name] = (value, pks)
+        return pks
+
+    @classmethod
+    def __get_bulk_node(cls, node):
+        if isinstance(node, cls):
+            return (node, [])
+        if isinstance(node, dict):
+            values = dict(node)
+            children = values.pop("children", None) or []
+            return (cls(**values), children)
+        if isinstance(node, (list, tuple)) and len(node) == 2:
+            return (node[0], node[1] or [])
+        raise ValueError(
+            f"Invalid node {node!r}, expected an instance of {cls.__name__}, "
+            "an (instance, children) tuple or a dict."
+        )
+
+    @classmethod
+    def __get_bulk_nodes(cls, data, parent=None):
+        # returns the nodes in the data order and the (obj, parent) nodes
+        # of each level, the data is visited without recursion
+        objs = []
+        levels = []
+        stack = [(node, parent, 0) for node in reversed(data)]
+        while stack:
+            node, node_parent, level = stack.pop()
+            obj, children = cls.__get_bulk_node(node)
+            objs.append(obj)
+            if len(levels) <= level:
+                levels.append([])
+            levels[level].append((obj, node_parent))
+            stack.extend((child, obj, level + 1) for child in reversed(children))
+        return (objs, levels)
+
+    def __get_lineage_pks(self):
+        # the ancestors pks from the root followed by the node pk
+        return (*self.get_ancestors_pks(), self.pk)
+
+    @staticmethod
+    def __get_common_lineage_len(lineages):
+        common_len = 0
+        for pks in zip(*lineages, strict=False):
+            if any(pk != pks[0] for pk in pks):
+                break
+            common_len += 1
+        return common_len
+
+    @classmethod
+    def __get_nodes_by_pks(cls, obj, pks, cache=True, using=None):
+        if cache:
+            try:
+                return query_cache(
+                    cls,
+                    pks=pks,
+                    using=obj.__get_db_for_write(using),
+                    scope=obj._get_scope(),
+                )
+            except CacheError:
+                pass
+        objs_qs = obj.__get_queryset(using).filter(pk__in=pks)
+        objs_dict = {str(obj.pk): obj for obj in objs_qs}
+        return [objs_dict.get(str(pk)) for pk in pks]
+
+    def __get_db_for_write(self, using=None):
+        # the database of the tree, used also as cache alias
+        return using or router.db_for_write(self.__class__, instance=self)
+
+    def __get_queryset(self, using=None):
+        cls = self.__class__
+        return cls.objects.using(using or router.db_for_read(cls, instance=self))
+
+    @classmethod
+    def __update_nodes_data(cls, objs_data, stats=None, using=None, scope=None):
+        stats = stats or TreeUpdateStats(cls)
+        stats.start_phase("update_rows")
+        using = using or router.db_for_write(cls)
+        with transaction.atomic(using=using):
+            obj_manager = cls.objects.using(using)
+            for obj_pk, obj_data in objs_data.items():
+                obj_manager.filter(pk=obj_pk).update(**obj_data)
+            tree_version = cls.__update_tree_version(
+                using=using, checksum=stats.checksum
+            )
+
+        # update in-memory instances
+        stats.start_phase("update_refs")
+        update_refs(cls, objs_data, using=using)
+
+        # update cache instances (read from the updated database, not replicas)
+        stats.start_phase("update_cache")
+        try:
+            update_cache(cls, using=using, read_using=using, scope=scope)
+        except CacheError:
+            pass
+
+        # update cache version (and serialized tree)
+        if tree_version:
+            cls.__update_tree_version_cache(tree_version, using=using, scope=scope)
+        stats.end_phase()
+
+    @classmethod
+    def __get_tree_checksum_fields(cls):
+        fields = [
+            "pk",
+            "tn_parent_id",
+            "tn_priority",
+            "tn_ancestors_count",
+            "tn_children_count",
+            "tn_descendants_count",
+            "tn_index",
+            "tn_level",
+            "tn_order",
+        ]
+        if cls.treenode_scope_field:
+            scope_field = cls._meta.get_field(cls.treenode_scope_field)
+            fields.append(scope_field.attname)
+        display_field_name = cls.treenode_display_field
+        if display_field_name:
+            try:
+                display_field = cls._meta.get_field(display_field_name)
+                fields.append(display_field.attname)
+            except FieldDoesNotExist:
+                pass
+        return fields
+
+    @staticmethod
+    def __get_tree_checksum_from_rows(rows):
+        checksum = hashlib.sha256()
+        for row in sorted(rows, key=lambda row: str(row[0])):
+            checksum.update(repr(row).encode("utf-8"))
+        return checksum.hexdigest()
+
+    @classmethod
+    def __get_tree_version(cls, using=None):
+        version = get_cached_version(cls, using=using)
+        if version is None:
+            version = TreeNodeVersion.get_version(cls, using=using)
+            set_cached_version(cls, version, using=using)
+        return version
+
+    @classmethod
+    async def __aget_tree_version(cls, using=None):
+        version = await aget_cached_version(cls, using=using)
+        if version is None:
+            version = await TreeNodeVersion.aget_version(cls, using=using)
+            await aset_cached_version(cls, version, using=using)
+        return version
+
+    @classmethod
+    def __update_tree_version(cls, using=None, checksum=None):
+        try:
+            version = TreeNodeVersion.bump_version(cls, using=using, checksum=checksum)
+        except DatabaseError as error:
+            # this may happen if treenode migrations have not been applied yet
+            logger.warning(
+                f"Unable to update {cls.__module__}.{cls.__name__} tree version: "
+                f"{error}"
+            )
+            return None
+        return version
+
+    @classmethod
+    def __update_tree_version_cache(cls, version, using=None, scope=None):
+        # the cache version is updated only after the cache instances
+        # to prevent serializing the previous tree with the new version
+        prev_version = get_cached_version(cls, using=using)
+        prev_tree_json = None
+        if prev_version is not None:
+            prev_tree_json = get_cached_tree_json(
+                cls, prev_version[0], using=using, scope=scope
+            )
+        set_cached_version(cls, version, using=using)
+        if prev_tree_json is not None:
+            # the serialized tree is in use, regenerate it in advance
+            cls.get_tree_json(using=using, scope=scope)
+
+    @staticmethod
+    def __get_order_str(priority, text, pk):
         priority_max = 9999999999
         priority_len = len(str(priority_max))
-        priority_val = priority_max - min(self.tn_priority, priority_max)
+        priority_val = priority_max - min(priority, priority_max)
         priority_key = str(priority_val).zfill(priority_len)
-        alphabetical_val = slugify(str(self))
+        alphabetical_val = slugify(text)
         alphabetical_key = alphabetical_val.ljust(priority_len, "z")
         alphabetical_key = alphabetical_key[0:priority_len]
 
-        if isinstance(self.pk, uuid.UUID):
-            pk_val = self.pk.int
+        if isinstance(pk, uuid.UUID):
+            pk_val = pk.int
             pk_val = int(str(pk_val)[:priority_len])
         else:
             try:
-                pk_val = min(self.pk, priority_max)
+                pk_val = min(pk, priority_max)
             except TypeError:
-                pk_val = str(self.pk)
+                pk_val = str(pk)
 
         pk_key = str(pk_val).zfill(priority_len)
         s = f"{priority_key}{alphabetical_key}{pk_key}"
         s = s.upper()
         return s
 
-    def __get_node_data(self, objs_list, objs_dict):
-        obj_dict = {}
+    def __get_node_order_str(self):
+        return self.__get_order_str(self.tn_priority, str(self), self.pk)
+
+    @classmethod
+    def __get_nodes_rows_fields(cls):
+        # the fields needed to compute the tree fields and the tree checksum,
+        # starting with pk, tn_parent_id and tn_priority
+        fields = cls.__get_tree_checksum_fields()
+        return fields + [key for key in cls.__tree_fields if key not in fields]
+
+    @classmethod
+    def __has_rows_display_text(cls):
+        # the display text (used to sort the nodes) can be computed from the rows
+        # if it is the value of a field and the display methods are not overridden
+        for name in ["__str__", "get_display", "get_display_text"]:
+            if getattr(cls, name) is not getattr(TreeNodeModel, name):
+                return False
+        field_name = cls.treenode_display_field
+        if field_name is None:
+            return True
+        try:
+            field = cls._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            return False
+        return field.concrete and not field.is_relation
+
+    @staticmethod
+    def __get_row_display_str(text, pk):
+        # the str(obj) value without the indentation (removed by slugify anyway),
+        # the text is escaped by get_display and then again by __str__
+        if not text and pk:
+            text = pk
+        return conditional_escape(force_str("") + conditional_escape(force_str(text)))
+
+    @classmethod
+    def __get_nodes_rows(cls, objs_qs, fields, chunk_size=None):
+        # returns the rows of the given fields and the order str of each node,
+        # model instances are loaded only if the display text is customized
+        rows = []
+        order_strs = {}
+        if cls.__has_rows_display_text():
+            display_field_name = cls.treenode_display_field
+            text_index = (
+                fields.index(display_field_name) if display_field_name else None
+            )
+            rows_qs = objs_qs.values_list(*fields)
+            for row in rows_qs.iterator(chunk_size) if chunk_size else rows_qs:
+                text = row[text_index] if text_index is not None else ""
+                text = cls.__get_row_display_str(text, row[0])
+                order_strs[str(row[0])] = cls.__get_order_str(row[2], text, row[0])
+                rows.append(row)
+            return (rows, order_strs)
+        with no_refs():
+            for obj in objs_qs.iterator(chunk_size) if chunk_size else objs_qs:
+                row = tuple(getattr(obj, field) for field in fields)
+                order_strs[str(row[0])] = obj.__get_node_order_str()
+                rows.append(row)
+        return (rows, order_strs)
+
+    @staticmethod
+    def __get_node_data(row, rows_dict, order_strs, circular_pks=None):
+        obj_key = str(row[0])
 
         # update ancestors
-        parent_pk = self.get_parent_pk()
+        parent_pk = row[1]
 
         ancestors_list = []
+        ancestors_keys = {obj_key}
         ancestor_pk = parent_pk
         while ancestor_pk:
-            ancestor_obj = objs_dict.get(str(ancestor_pk))
-            if not ancestor_obj:
+            ancestor_key = str(ancestor_pk)
+            if ancestor_key in ancestors_keys:
+                # the node (or one of its ancestors) is an ancestor of itself
+                if circular_pks is None:
+                    raise CircularReferenceError()
+                if ancestor_key == obj_key:
+                    circular_pks.append(obj_key)
+                break
+            ancestor_row = rows_dict.get(ancestor_key)
+            if not ancestor_row:
                 # this may happen loading fixtures, when the current object
                 # references a parent object that has not been created yet
                 break
-            ancestors_list.insert(0, ancestor_obj)
-            ancestor_pk = ancestor_obj.get_parent_pk()
-        ancestors_pks = [obj.pk for obj in ancestors_list]
+            ancestors_list.append(ancestor_row)
+            ancestors_keys.add(ancestor_key)
+            ancestor_pk = ancestor_row[1]
+        ancestors_list.reverse()
+        ancestors_pks = [ancestor_row[0] for ancestor_row in ancestors_list]
         ancestors_count = len(ancestors_pks)
 
-        order_objs = list(ancestors_list) + [self]
-        order_strs = [obj.__get_node_order_str() for obj in order_objs]
-        order_str = "".join(order_strs)
+        # the order str of each node is computed once and reused for its descendants
+        order_str = "".join(
+            [order_strs[str(ancestor_pk)] for ancestor_pk in ancestors_pks]
+            + [order_strs[obj_key]]
+        )
 
         obj_dict = {
-            "instance": self,
-            "pk": self.pk,
+            "row": row,
+            "pk": row[0],
             "tn_parent_pk": parent_pk,
             "tn_ancestors_pks": ancestors_pks,
             "tn_ancestors_count": ancestors_count,
@@ -526,46 +1383,83 @@ class TreeNodeModel(models.Model):
         return obj_dict
 
     @classmethod
-    def __get_nodes_data(cls):  # noqa: C901
-        circular_refs = cls.objects.filter(
-            Q(pk=F("tn_parent_id"))
-            | Q(
-                tn_parent_id__tn_parent_id=F("pk"),
-                tn_parent_id__isnull=False,
+    def __get_nodes_data(  # noqa: C901
+        cls,
+        chunk_size=None,
+        stats=None,
+        using=None,
+        scope=None,
+        checksum=True,
+        circular_pks=None,
+    ):
+        # nodes are read as rows of the needed fields (not as model instances),
+        # with circular_pks (a list) the pks of the nodes that are ancestors
+        # of themselves are appended to it instead of raising an error
+        stats = stats or TreeUpdateStats(cls)
+        stats.start_phase("check_circular_refs")
+        objs_manager = cls._filter_scope(cls.objects.using(using).all(), scope)
+        if circular_pks is None:
+            circular_refs = objs_manager.filter(
+                Q(pk=F("tn_parent_id"))
+                | Q(
+                    tn_parent_id__tn_parent_id=F("pk"),
+                    tn_parent_id__isnull=False,
+                )
             )
-        )
-        if circular_refs.exists():
-            raise CircularReferenceError()
+            if circular_refs.exists():
+                raise CircularReferenceError()
 
-        objs_qs = cls.objects.select_related("tn_parent")
-        objs_list = list(objs_qs)
-        objs_dict = {str(obj.pk): obj for obj in objs_list}
+        stats.start_phase("load_nodes")
+        fields = cls.__get_nodes_rows_fields()
+        fields_index = {field: index for index, field in enumerate(fields)}
+        rows, order_strs = cls.__get_nodes_rows(objs_manager, fields, chunk_size)
+        rows_dict = {str(row[0]): row for row in rows}
+        stats.nodes = len(rows)
+
+        stats.start_phase("compute_order")
         objs_data_dict = {
-            str(obj.pk): obj.__get_node_data(objs_list, objs_dict) for obj in objs_list
+            str(row[0]): cls.__get_node_data(row, rows_dict, order_strs, circular_pks)
+            for row in rows
         }
+        scope_index = None
+        if cls.treenode_scope_field:
+            scope_field = cls._meta.get_field(cls.treenode_scope_field)
+            scope_index = fields_index[scope_field.attname]
+        for obj_data in objs_data_dict.values():
+            row = obj_data["row"]
+            obj_data["scope"] = row[scope_index] if scope_index is not None else None
 
         def objs_data_sort(obj):
             return objs_data_dict[str(obj["pk"])]["tn_order_str"]
 
+        stats.start_phase("sort_nodes")
         objs_data_list = list(objs_data_dict.values())
         objs_data_list.sort(key=objs_data_sort)
+
+        def objs_parent_key(obj_data):
+            # roots of different scopes are not siblings
+            if obj_data["tn_parent_pk"] is None:
+                return (None, obj_data["scope"])
+            return str(obj_data["tn_parent_pk"])
+
+        stats.start_phase("compute_fields")
         objs_pks_by_parent = {}
-        objs_order_cursor = 0
+        objs_order_cursors = {}
         objs_index_cursors = {}
         objs_index_cursor = 0
 
         # index objects by parent pk
         for obj_data in objs_data_list:
-            obj_parent_key = str(obj_data["tn_parent_pk"])
+            obj_parent_key = objs_parent_key(obj_data)
             objs_pks_by_parent.setdefault(obj_parent_key, [])
             objs_pks_by_parent[obj_parent_key].append(obj_data["pk"])
 
-            # update global order with normalized value
+            # update scope order with normalized value
+            objs_order_cursor = objs_order_cursors.get(obj_data["scope"], 0)
             obj_data["tn_order"] = objs_order_cursor
-            objs_order_cursor += 1
+            objs_order_cursors[obj_data["scope"]] = objs_order_cursor + 1
 
             # update child index
-            obj_parent_key = str(obj_data["tn_parent_pk"])
             objs_index_cursor = objs_index_cursors.get(obj_parent_key, 0)
             obj_data["tn_index"] = objs_index_cursor
             objs_index_cursor += 1
@@ -582,7 +1476,7 @@ class TreeNodeModel(models.Model):
             obj_data["tn_children_count"] = len(obj_data["tn_children_pks"])
 
             # update siblings
-            siblings_parent_key = str(obj_data["tn_parent_pk"])
+            siblings_parent_key = objs_parent_key(obj_data)
             obj_data["tn_siblings_pks"] = list(
                 objs_pks_by_parent.get(siblings_parent_key, [])
             )
@@ -616,69 +1510,193 @@ class TreeNodeModel(models.Model):
                     )
                     obj_data["tn_depth"] = obj_depth
 
+        pks_encoding = cls.treenode_pks_encoding
         for obj_data in objs_data_list:
-            obj = obj_data["instance"]
+            row = obj_data["row"]
             obj_key = str(obj_data["pk"])
 
             # join all pks lists
-            obj_data["tn_ancestors_pks"] = join_pks(obj_data["tn_ancestors_pks"])
-            obj_data["tn_children_pks"] = join_pks(obj_data["tn_children_pks"])
-            obj_data["tn_descendants_pks"] = join_pks(obj_data["tn_descendants_pks"])
-            obj_data["tn_siblings_pks"] = join_pks(obj_data["tn_siblings_pks"])
+            for key in [
+                "tn_ancestors_pks",
+                "tn_children_pks",
+                "tn_descendants_pks",
+                "tn_siblings_pks",
+            ]:
+                obj_data[key] = join_pks(obj_data[key], encoding=pks_encoding)
 
             # clean data
-            obj_data.pop("instance", None)
+            obj_data.pop("row", None)
             obj_data.pop("pk", None)
             obj_data.pop("tn_parent_pk", None)
             obj_data.pop("tn_order_str", None)
+            obj_data.pop("scope", None)
 
-            keys = [
-                "tn_ancestors_count",
-                "tn_ancestors_pks",
-                "tn_children_count",
-                "tn_children_pks",
-                "tn_depth",
-                "tn_descendants_count",
-                "tn_descendants_pks",
-                "tn_index",
-                "tn_level",
-                "tn_order",
-                "tn_siblings_count",
-                "tn_siblings_pks",
-            ]
-            for key in keys:
-                if obj_data[key] == getattr(obj, key, None):
+            for key in cls.__tree_fields:
+                if obj_data[key] == row[fields_index[key]]:
                     obj_data.pop(key, None)
 
             if len(obj_data) == 0:
                 objs_data_dict.pop(obj_key, None)
 
+        # compute the checksum of the updated tree (if it will be written),
+        # it can't be computed updating the nodes of a single scope
+        stats.start_phase("compute_checksum")
+        if not checksum or (scope is not None and cls.treenode_scope_field):
+            stats.end_phase()
+            return objs_data_dict
+        checksum_fields = cls.__get_tree_checksum_fields()
+        checksum_rows = []
+        for row in rows:
+            obj_data = objs_data_dict.get(str(row[0]), {})
+            checksum_rows.append(
+                tuple(
+                    obj_data[field] if field in obj_data else row[fields_index[field]]
+                    for field in checksum_fields
+                )
+            )
+        stats.checksum = cls.__get_tree_checksum_from_rows(checksum_rows)
+
+        stats.end_phase()
         return objs_data_dict
 
+    @staticmethod
+    def __validate_walk_order(order):
+        if order not in ("pre", "post", "level"):
+            raise ValueError(
+                f"Invalid walk order {order!r}, "
+                "expected one of 'pre', 'post' or 'level'."
+            )
+
+    @staticmethod
+    def __get_walk_children(obj, objs_dict):
+        # the children pks are parsed once for each tn_children_pks value
+        return [objs_dict[pk] for pk in obj.get_children_pks() if pk in objs_dict]
+
     @classmethod
-    def __get_nodes_tree(cls, instance=None, cache=True):
-        def __get_node_tree(obj):
-            child_tree = {"node": obj, "tree": []}
-            child_tree_append = child_tree["tree"].append
-            if obj.tn_children_pks:
-                children_pks = split_pks(obj.tn_children_pks)
-                for child_pk in children_pks:
-                    child_obj = objs_dict.get(child_pk)
-                    if child_obj:
-                        child_tree_append(__get_node_tree(child_obj))
-            return child_tree
+    def __walk_nodes(cls, objs, objs_dict, order="pre"):
+        """
+        Iterates the given nodes and their descendants without recursion,
+        yielding (node, depth, event) tuples, depth starts from 0.
+        'pre' yields an 'enter' event before the node descendants and an 'exit'
+        event after them, 'post' yields only the 'exit' events (children first)
+        and 'level' yields only the 'enter' events in breadth-first order.
+        """
+        get_children = cls.__get_walk_children
+        if order == "level":
+            queue = deque((obj, 0) for obj in objs)
+            while queue:
+                obj, depth = queue.popleft()
+                yield (obj, depth, "enter")
+                queue.extend(
+                    (child_obj, depth + 1) for child_obj in get_children(obj, objs_dict)
+                )
+            return
+        stack = [(obj, 0, False) for obj in reversed(objs)]
+        while stack:
+            obj, depth, visited = stack.pop()
+            if visited:
+                yield (obj, depth, "exit")
+                continue
+            if order == "pre":
+                yield (obj, depth, "enter")
+            stack.append((obj, depth, True))
+            stack.extend(
+                (child_obj, depth + 1, False)
+                for child_obj in reversed(get_children(obj, objs_dict))
+            )
 
+    @classmethod
+    def __walk_objs(cls, objs_list, instance=None, order="pre"):
+        objs_dict = {obj.pk: obj for obj in objs_list}
         if instance:
-            objs_list = instance.get_descendants(cache=cache)
-            objs_dict = {str(obj.pk): obj for obj in objs_list}
-            objs_tree = __get_node_tree(instance)["tree"]
+            objs_roots = cls.__get_walk_children(instance, objs_dict)
         else:
-            objs_list = cls._get_all(cache=cache)
-            objs_dict = {str(obj.pk): obj for obj in objs_list}
-            objs_tree = [__get_node_tree(obj) for obj in objs_list if obj.tn_level == 1]
+            objs_roots = [obj for obj in objs_list if obj.tn_level == 1]
+        return cls.__walk_nodes(objs_roots, objs_dict, order=order)
 
+    @classmethod
+    def __get_nodes_tree(
+        cls, instance=None, cache=True, node_func=None, using=None, scope=None
+    ):
+        if instance:
+            objs_list = instance.get_descendants(cache=cache, using=using)
+        else:
+            objs_list = cls._get_all(cache=cache, using=using, scope=scope)
+        return cls.__build_nodes_tree(objs_list, instance=instance, node_func=node_func)
+
+    @classmethod
+    def __build_nodes_tree(cls, objs_list, instance=None, node_func=None):
+        objs_tree = []
+        objs_stack = []
+        objs_walk = cls.__walk_objs(objs_list, instance=instance, order="pre")
+        for obj, _depth, event in objs_walk:
+            if event == "exit":
+                objs_stack.pop()
+                continue
+            obj_tree = {"node": node_func(obj) if node_func else obj, "tree": []}
+            if objs_stack:
+                objs_stack[-1]["tree"].append(obj_tree)
+            else:
+                objs_tree.append(obj_tree)
+            objs_stack.append(obj_tree)
         return objs_tree
 
+    @classmethod
+    def __dump_nodes_tree_json(cls, objs_list, instance=None):
+        objs_tree = cls.__build_nodes_tree(
+            objs_list, instance=instance, node_func=lambda obj: obj.get_tree_json_data()
+        )
+        objs_tree_json = json.dumps(
+            objs_tree, cls=DjangoJSONEncoder, separators=(",", ":")
+        )
+        return objs_tree_json.encode("utf-8")
+
+    @classmethod
+    def __get_nodes_tree_json(cls, instance=None, cache=True, using=None, scope=None):
+        def get_tree_json():
+            if instance:
+                objs_list = instance.get_descendants(cache=cache, using=using)
+            else:
+                objs_list = cls._get_all(cache=cache, using=using, scope=scope)
+            return cls.__dump_nodes_tree_json(objs_list, instance=instance)
+
+        if not cache:
+            return get_tree_json()
+        pk = instance.pk if instance else None
+        version = cls.get_tree_version(using=using)
+        tree_json = get_cached_tree_json(cls, version, pk=pk, using=using, scope=scope)
+        if tree_json is None:
+            tree_json = get_tree_json()
+            set_cached_tree_json(
+                cls, version, tree_json, pk=pk, using=using, scope=scope
+            )
+        return tree_json
+
+    @classmethod
+    async def __aget_nodes_tree_json(
+        cls, instance=None, cache=True, using=None, scope=None
+    ):
+        async def aget_tree_json():
+            if instance:
+                objs_list = await instance.aget_descendants(cache=cache, using=using)
+            else:
+                objs_list = await cls._aget_all(cache=cache, using=using, scope=scope)
+            return cls.__dump_nodes_tree_json(objs_list, instance=instance)
+
+        if not cache:
+            return await aget_tree_json()
+        pk = instance.pk if instance else None
+        version = (await cls.__aget_tree_version(using=using))[0]
+        tree_json = await aget_cached_tree_json(
+            cls, version, pk=pk, using=using, scope=scope
+        )
+        if tree_json is None:
+            tree_json = await aget_tree_json()
+            await aset_cached_tree_json(
+                cls, version, tree_json, pk=pk, using=using, scope=scope
+            )
+        return tree_json
+
     # Public properties
     # All properties map a get_{{property}}() method.
 
@@ -798,6 +1816,10 @@ class TreeNodeModel(models.Model):
     def tree_display(cls):  # noqa: B902
         return cls.get_tree_display()
 
+    @classproperty
+    def tree_is_dirty(cls):  # noqa: B902
+        return cls.is_tree_dirty()
+
     class Meta:
         abstract = True
         ordering = ["tn_order"]
@@ -806,4 +1828,87 @@ class TreeNodeModel(models.Model):
         return conditional_escape(self.get_display(indent=True))
 
 
+class TreeNodeVersion(models.Model):
+    """
+    Stores the tree version of each TreeNodeModel subclass,
+    the version is incremented every time the tree is updated.
+    """
+
+    model = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name=_("Model"),
+    )
+
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name=_("Version"),
+    )
+
+    updated_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name=_("Updated at"),
+    )
+
+    checksum = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        verbose_name=_("Checksum"),
+    )
+
+    @staticmethod
+    def _get_model_label(cls):
+        return cls._meta.concrete_model._meta.label_lower
+
+    @classmethod
+    def bump_version(cls, model, using=None, checksum=None):
+        label = cls._get_model_label(model)
+        values = {"updated_at": timezone.now()}
+        if checksum is not None:
+            values["checksum"] = checksum
+        with transaction.atomic(using=using):
+            versions_qs = cls.objects.using(using).filter(model=label)
+            if not versions_qs.update(version=F("version") + 1, **values):
+                cls.objects.using(using).get_or_create(
+                    model=label, defaults={"version": 1, **values}
+                )
+            return versions_qs.values_list("version", "updated_at").get()
+
+    @classmethod
+    def get_checksum(cls, model, using=None):
+        label = cls._get_model_label(model)
+        using = using or router.db_for_read(model)
+        versions_qs = cls.objects.using(using).filter(model=label)
+        return versions_qs.values_list("checksum", flat=True).first()
+
+    @classmethod
+    def get_version(cls, model, using=None):
+        label = cls._get_model_label(model)
+        using = using or router.db_for_read(model)
+        versions_qs = cls.objects.using(using).filter(model=label)
+        try:
+            return versions_qs.values_list("version", "updated_at").get()
+        except cls.DoesNotExist:
+            return (0, None)
+
+    @classmethod
+    async def aget_version(cls, model, using=None):
+        label = cls._get_model_label(model)
+        using = using or router.db_for_read(model)
+        versions_qs = cls.objects.using(using).filter(model=label)
+        try:
+            return await versions_qs.values_list("version", "updated_at").aget()
+        except cls.DoesNotExist:
+            return (0, None)
+
+    class Meta:
+        verbose_name = _("Tree version")
+        verbose_name_plural = _("Tree versions")
+
+    def __str__(self):
+        return f"{self.model} (version {self.version})"
+
+
 connect_signals()
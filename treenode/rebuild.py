@@ -0,0 +1,218 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from inspect import isabstract
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils.module_loading import import_string
+
+from treenode.cache import set_cached_dirty
+
+logger = logging.getLogger(__name__)
+
+UPDATE_MODE_IMMEDIATE = "immediate"
+UPDATE_MODE_BACKGROUND = "background"
+UPDATE_MODE_ON_COMMIT = "on_commit"
+UPDATE_MODES = (UPDATE_MODE_IMMEDIATE, UPDATE_MODE_BACKGROUND, UPDATE_MODE_ON_COMMIT)
+
+
+def get_treenode_models(labels=None, include_proxy=False):
+    """
+    Returns the TreeNodeModel models matching the given "app_label.ModelName"
+    labels (all the TreeNodeModel models if omitted), raises ValueError
+    if any label doesn't match a TreeNodeModel model.
+    """
+    from treenode.models import TreeNodeModel
+
+    if not labels:
+        return [
+            model
+            for model in apps.get_models()
+            if issubclass(model, TreeNodeModel)
+            and not isabstract(model)
+            and (include_proxy or not model._meta.proxy)
+        ]
+    models = []
+    for label in labels:
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as error:
+            raise ValueError(f"Invalid model {label!r}: {error}") from error
+        if not issubclass(model, TreeNodeModel):
+            raise ValueError(f"Invalid model {label!r}: not a TreeNodeModel.")
+        models.append(model)
+    return models
+
+
+def _can_update_trees_in_parallel(models, using=None):
+    # sqlite doesn't support concurrent writes from multiple connections
+    return all(
+        connections[using or router.db_for_write(model)].vendor != "sqlite"
+        for model in models
+    )
+
+
+def _update_tree_in_thread(model, dry_run=False, using=None):
+    try:
+        return model.update_tree(dry_run=dry_run, using=using)
+    finally:
+        # each thread uses its own database connections
+        connections.close_all()
+
+
+def update_trees(models, workers=None, dry_run=False, using=None):
+    """
+    Updates the trees of the given models (in the given database alias)
+    and returns the list of TreeUpdateStats objects returned by each model
+    update_tree. Trees are updated in parallel, each one in its own thread
+    and with its own database connection, unless workers=1
+    or any of the databases is sqlite.
+    """
+    models = list(models)
+    workers = min(workers or len(models), len(models))
+    if workers <= 1 or not _can_update_trees_in_parallel(models, using=using):
+        return [model.update_tree(dry_run=dry_run, using=using) for model in models]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_update_tree_in_thread, model, dry_run=dry_run, using=using)
+            for model in models
+        ]
+        return [future.result() for future in futures]
+
+
+class _TreeUpdateWorker:
+    """
+    Updates the trees of the pending models in a background thread started
+    after the update interval, all the updates requested for a model
+    during the interval are coalesced in a single tree update
+    (one for each database and scope).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__timer = None
+
+    def add(self, model, using=None, scope=None):
+        with self.__lock:
+            self.__pending[(model, using, scope)] = True
+            if self.__timer is None:
+                self.__timer = threading.Timer(_get_update_interval(), self.__run)
+                self.__timer.name = "treenode-update-worker"
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def run_pending(self):
+        with self.__lock:
+            pending = list(self.__pending)
+            self.__pending.clear()
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+        for model, using, scope in pending:
+            try:
+                model.update_tree(using=using, scope=scope)
+            except Exception:
+                logger.exception(f"Error updating {model._meta.label} tree.")
+        return [model for model, _using, _scope in pending]
+
+    def __run(self):
+        try:
+            self.run_pending()
+        finally:
+            # the thread used its own database connections
+            connections.close_all()
+
+
+_worker = _TreeUpdateWorker()
+
+
+def _get_update_interval():
+    return getattr(settings, "TREENODE_UPDATE_INTERVAL", 1.0)
+
+
+def _get_update_mode():
+    mode = getattr(settings, "TREENODE_UPDATE_MODE", UPDATE_MODE_IMMEDIATE)
+    if mode not in UPDATE_MODES:
+        raise ValueError(
+            f"Invalid settings.TREENODE_UPDATE_MODE {mode!r}, "
+            f"expected one of {UPDATE_MODES!r}."
+        )
+    return mode
+
+
+@lru_cache
+def _import_update_runner(path):
+    return import_string(path)
+
+
+def _get_update_runner():
+    path = getattr(settings, "TREENODE_UPDATE_RUNNER", None)
+    return _import_update_runner(path) if path else _worker.add
+
+
+def _schedule_tree_update_on_commit(model, using=None, scope=None):
+    # schedule at most one update per model and scope for each transaction
+    # (and database), callbacks of rolled back savepoints are discarded by django,
+    # so a new one is scheduled by the next change
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    for _, func, *_ in connection.run_on_commit:
+        if (
+            getattr(func, "treenode_model", None) is model
+            and getattr(func, "treenode_scope", None) == scope
+        ):
+            return
+
+    def update_tree():
+        model.update_tree(using=using, scope=scope)
+
+    update_tree.treenode_model = model
+    update_tree.treenode_scope = scope
+    transaction.on_commit(update_tree, using=using)
+
+
+def _schedule_tree_update_in_background(model, using=None, scope=None):
+    # the tree is marked dirty and passed to the runner after the current
+    # transaction is committed (now if there is no transaction), otherwise
+    # the runner could update it from the old rows and clear the dirty flag
+    using = using or router.db_for_write(model)
+    update_runner = _get_update_runner()
+
+    def schedule_update():
+        set_cached_dirty(model, using=using, scope=scope)
+        update_runner(model, using, scope)
+
+    transaction.on_commit(schedule_update, using=using)
+
+
+def run_pending_tree_updates():
+    """
+    Updates now the trees pending in the background worker (eg. before exiting
+    or in tests) and returns the list of the updated models.
+    """
+    return _worker.run_pending()
+
+
+def schedule_tree_update(model, using=None, scope=None):
+    """
+    Updates the model tree according to settings.TREENODE_UPDATE_MODE:
+    The tree is updated in the given database alias and scope (the ones of
+    the changed instance), "immediate" (default) updates it now, "on_commit"
+    updates it once after
+    the current transaction is committed (now if there is no transaction),
+    "background" marks it as dirty and passes it (after the current transaction
+    is committed) to the settings.TREENODE_UPDATE_RUNNER callable (by default
+    an in-process worker updating it after settings.TREENODE_UPDATE_INTERVAL).
+    """
+    mode = _get_update_mode()
+    if mode == UPDATE_MODE_BACKGROUND:
+        _schedule_tree_update_in_background(model, using=using, scope=scope)
+    elif mode == UPDATE_MODE_ON_COMMIT:
+        _schedule_tree_update_on_commit(model, using=using, scope=scope)
+    else:
+        model.update_tree(using=using, scope=scope)
@@ -1,13 +1,22 @@
 from inspect import isabstract, isclass
 
-from django.db import connections
-from django.db.models.signals import post_delete, post_init, post_migrate, post_save
+from django.conf import settings
+from django.db import connections, router
+from django.db.models.signals import (
+    class_prepared,
+    post_delete,
+    post_init,
+    post_migrate,
+    post_save,
+)
 
 from treenode.memory import set_ref
+from treenode.rebuild import schedule_tree_update, update_trees
 
-
-def __table_exists(table_name: str, connection_name: str) -> bool:
-    return table_name in connections[connection_name].introspection.table_names()
+# concrete TreeNodeModel subclasses, instances signals handlers are connected
+# only to them, so that other models instances don't pay any overhead
+__senders__ = []
+__senders_signals_connected__ = False
 
 
 def __is_treenode_model(sender):
@@ -23,45 +32,109 @@ def __is_treenode_model(sender):
     )
 
 
-def post_init_treenode(sender, instance, **kwargs):
+def class_prepared_treenode(sender, **kwargs):
     if not __is_treenode_model(sender):
         return
+    scope_field = sender.treenode_scope_field
+    if scope_field and list(sender._meta.ordering) == ["tn_order"]:
+        # tn_order is numbered per scope, keep the nodes of each scope together
+        sender._meta.ordering = [scope_field, "tn_order"]
+    __senders__.append(sender)
+    if __senders_signals_connected__:
+        __connect_sender_signals(sender)
+
+
+def post_init_treenode(sender, instance, **kwargs):
     set_ref(sender, instance)
 
 
+def __is_tree_consistent(sender, using, table_names):
+    from .models import TreeNodeVersion
+
+    if TreeNodeVersion._meta.db_table not in table_names:
+        return False
+    checksum = TreeNodeVersion.get_checksum(sender, using=using)
+    return bool(checksum) and checksum == sender.get_tree_checksum(using=using)
+
+
 def post_migrate_treenode(sender, **kwargs):
-    for sender_model in list(sender.get_models()):
-        if __is_treenode_model(sender_model) and __table_exists(
-            table_name=sender_model._meta.db_table, connection_name=kwargs["using"]
-        ):
-            sender_model.update_tree()
+    using = kwargs["using"]
+    # proxy models share the tree of their concrete model
+    sender_models = [
+        sender_model
+        for sender_model in sender.get_models()
+        if __is_treenode_model(sender_model) and not sender_model._meta.proxy
+    ]
+    if not sender_models:
+        return
+    table_names = set(connections[using].introspection.table_names())
+    sender_models = [
+        sender_model
+        for sender_model in sender_models
+        if sender_model._meta.db_table in table_names
+        and router.allow_migrate_model(using, sender_model)
+        and not __is_tree_consistent(sender_model, using, table_names)
+    ]
+    workers = getattr(settings, "TREENODE_POST_MIGRATE_WORKERS", None)
+    update_trees(sender_models, workers=workers, using=using)
 
 
 def post_save_treenode(sender, instance, **kwargs):
-    if not __is_treenode_model(sender):
-        return
     set_ref(sender, instance)
-    sender.update_tree()
+    scope = instance._get_scope()
+    saved_scope = instance._get_saved_scope()
+    if saved_scope != scope:
+        # the node left its previous scope, update that tree too
+        schedule_tree_update(sender, using=kwargs.get("using"), scope=saved_scope)
+    schedule_tree_update(sender, using=kwargs.get("using"), scope=scope)
 
 
 def post_delete_treenode(sender, instance, **kwargs):
-    if not __is_treenode_model(sender):
-        return
-    sender.update_tree()
+    schedule_tree_update(sender, using=kwargs.get("using"), scope=instance._get_scope())
+
+
+def __connect_sender_signals(sender):
+    if sender.treenode_track_instances:
+        post_init.connect(
+            post_init_treenode, sender=sender, dispatch_uid="post_init_treenode"
+        )
+    post_save.connect(
+        post_save_treenode, sender=sender, dispatch_uid="post_save_treenode"
+    )
+    post_delete.connect(
+        post_delete_treenode, sender=sender, dispatch_uid="post_delete_treenode"
+    )
+
+
+def __disconnect_sender_signals(sender):
+    post_init.disconnect(
+        post_init_treenode, sender=sender, dispatch_uid="post_init_treenode"
+    )
+    post_save.disconnect(
+        post_save_treenode, sender=sender, dispatch_uid="post_save_treenode"
+    )
+    post_delete.disconnect(
+        post_delete_treenode, sender=sender, dispatch_uid="post_delete_treenode"
+    )
 
 
 def connect_signals():
-    post_init.connect(post_init_treenode, dispatch_uid="post_init_treenode")
+    global __senders_signals_connected__
+    class_prepared.connect(
+        class_prepared_treenode, dispatch_uid="class_prepared_treenode"
+    )
     post_migrate.connect(post_migrate_treenode, dispatch_uid="post_migrate_treenode")
-    post_save.connect(post_save_treenode, dispatch_uid="post_save_treenode")
-    post_delete.connect(post_delete_treenode, dispatch_uid="post_delete_treenode")
+    for sender in __senders__:
+        __connect_sender_signals(sender)
+    __senders_signals_connected__ = True
 
 
 def disconnect_signals():
-    post_init.disconnect(post_init_treenode, dispatch_uid="post_init_treenode")
+    global __senders_signals_connected__
     post_migrate.disconnect(post_migrate_treenode, dispatch_uid="post_migrate_treenode")
-    post_save.disconnect(post_save_treenode, dispatch_uid="post_save_treenode")
-    post_delete.disconnect(post_delete_treenode, dispatch_uid="post_delete_treenode")
+    for sender in __senders__:
+        __disconnect_sender_signals(sender)
+    __senders_signals_connected__ = False
 
 
 class no_signals:
@@ -1,19 +1,130 @@
+import base64
+import uuid
+
 PKS_SEPARATOR = ","
 
+PKS_ENCODING_TEXT = "text"
+PKS_ENCODING_COMPACT = "compact"
+PKS_ENCODINGS = (PKS_ENCODING_TEXT, PKS_ENCODING_COMPACT)
+
+# compact encoded strings start with a prefix that can't be found
+# in text encoded integer and uuid pks, strings are decoded by their prefix
+# whatever the configured encoding, so the ones written before switching
+# encoding (in both directions) can still be decoded
+PKS_COMPACT_INT_PREFIX = "~i"
+PKS_COMPACT_UUID_PREFIX = "~u"
+
+
+def __encode_int_pks(ls):
+    # zigzag encoded deltas between consecutive pks as varints
+    data = bytearray()
+    prev_pk = 0
+    for pk in ls:
+        delta = pk - prev_pk
+        prev_pk = pk
+        value = (delta << 1) if delta >= 0 else ((-delta << 1) - 1)
+        while value > 0x7F:
+            data.append((value & 0x7F) | 0x80)
+            value >>= 7
+        data.append(value)
+    return PKS_COMPACT_INT_PREFIX + base64.b64encode(data).decode("ascii")
+
+
+def __decode_int_pks(s):
+    data = base64.b64decode(s[len(PKS_COMPACT_INT_PREFIX) :])
+    ls = []
+    pk = 0
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        pk += (value >> 1) if not (value & 1) else -((value + 1) >> 1)
+        ls.append(pk)
+        value = 0
+        shift = 0
+    return ls
+
+
+def __encode_uuid_pks(ls):
+    data = b"".join(pk.bytes for pk in ls)
+    return PKS_COMPACT_UUID_PREFIX + base64.b64encode(data).decode("ascii")
+
 
-def contains_pk(ls, pk):
-    return str(pk) in split_pks(ls)
+def __decode_uuid_pks(s):
+    data = base64.b64decode(s[len(PKS_COMPACT_UUID_PREFIX) :])
+    return [uuid.UUID(bytes=data[i : i + 16]) for i in range(0, len(data), 16)]
 
 
-def join_pks(ls):
+def __is_compact(s):
+    # compact encoded strings never contain the separator of text encoded pks
+    return (
+        s.startswith((PKS_COMPACT_INT_PREFIX, PKS_COMPACT_UUID_PREFIX))
+        and PKS_SEPARATOR not in s
+    )
+
+
+def __decode_pks(s):
+    if s.startswith(PKS_COMPACT_INT_PREFIX):
+        return __decode_int_pks(s)
+    return __decode_uuid_pks(s)
+
+
+def contains_pk(s, pk, encoding=None):
+    if not s:
+        return False
+    if __is_compact(s):
+        pk_str = str(pk)
+        return any(str(v) == pk_str for v in __decode_pks(s))
+    # search the separated pk in the separated string without splitting it
+    sep = PKS_SEPARATOR
+    return f"{sep}{pk}{sep}" in f"{sep}{s}{sep}"
+
+
+def join_pks(ls, encoding=None):
+    """
+    Joins the pks in a string, with the "compact" encoding integer pks
+    are stored as varint deltas and uuid pks as 16 bytes (base64 encoded).
+    """
+    if encoding not in (None, *PKS_ENCODINGS):
+        raise ValueError(
+            f"Invalid pks encoding {encoding!r}, expected one of {PKS_ENCODINGS!r}."
+        )
     if not ls:
         return ""
+    if encoding == PKS_ENCODING_COMPACT:
+        if all(isinstance(v, int) for v in ls):
+            return __encode_int_pks(ls)
+        if all(isinstance(v, uuid.UUID) for v in ls):
+            return __encode_uuid_pks(ls)
+        raise ValueError(
+            "Invalid pks for compact encoding, expected integer or uuid pks."
+        )
     s = PKS_SEPARATOR.join([str(v) for v in ls])
     return s
 
 
-def split_pks(s):
+def parse_pks(s, to_python=None, encoding=None):
+    """
+    Returns the tuple of the pks in the given string,
+    converted to their native type using the to_python function,
+    compact encoded strings are decoded whatever the given encoding.
+    """
+    if s and __is_compact(s):
+        # compact encoded pks are already decoded to their native type
+        return tuple(__decode_pks(s))
+    ls = split_pks(s)
+    if to_python:
+        return tuple(to_python(v) for v in ls)
+    return tuple(ls)
+
+
+def split_pks(s, encoding=None):
     if not s:
         return []
+    if __is_compact(s):
+        return [str(v) for v in __decode_pks(s)]
     ls = [v for v in s.split(PKS_SEPARATOR) if v]
     return ls